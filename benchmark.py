@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import dataset
+import fetch
+import run_sir
+import simulate
+import fitting
+import instrument
+import metrics
+import store
+import synthetic
+import update_dataset
+
+def best_time(fn, *args, repeat=3):
+  """
+  Time a function call.
+
+  params:
+  fn(function): function to call.
+  repeat(int): number of runs.
+
+  return(tuple): (best wall time in seconds, result of the last call)
+  """
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+class SlowHandler(SimpleHTTPRequestHandler):
+  """
+  Static file handler that adds a fixed delay to every response.
+  """
+  latency = 0.0
+  def do_GET(self):
+    time.sleep(self.latency)
+    super().do_GET()
+  def log_message(self, *args):
+    pass
+
+def serve(directory, latency = 0.0):
+  """
+  Serve a directory over HTTP on a free local port in a background thread.
+
+  params:
+  directory(str): directory to serve.
+  latency(float): seconds to delay every response.
+
+  return(ThreadingHTTPServer): running server.
+  """
+  handler = type('Handler', (SlowHandler,), {'latency': latency})
+  server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=directory))
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+LOAD_SCRIPT = """
+import json, os, sys, time
+import numpy as np
+import store
+def rss_kb():
+  with open('/proc/self/statm') as f:
+    return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+path, fmt = sys.argv[1:]
+before = rss_kb()
+start = time.perf_counter()
+if fmt == 'json':
+  with open(path) as f:
+    points = json.load(f)
+  total = sum(int(np.array(v[m]).sum()) for v in points.values() for m in ['confirmed','deaths','recovered'])
+else:
+  s = store.load_store(path)
+  total = sum(int(m.sum(dtype=np.int64)) for m in s.series.values())
+elapsed = time.perf_counter() - start
+after = rss_kb()
+print(json.dumps({'time': elapsed, 'rss_kb': after - before, 'total': total}))
+"""
+
+def measure_load(path, fmt):
+  """
+  Load an artifact in a fresh interpreter and sum every series.
+
+  params:
+  path(str): JSON file or store directory.
+  fmt(str): 'json' or 'store'.
+
+  return(dict): load time in seconds, resident set growth in KB and the grand total.
+  """
+  here = os.path.dirname(os.path.abspath(__file__))
+  out = subprocess.check_output([sys.executable, '-c', LOAD_SCRIPT, path, fmt], cwd=here)
+  return json.loads(out)
+
+def legacy_parse_countries(frames):
+  """
+  Reference implementation of the original row-by-row dict building.
+  """
+  data = {}
+  for c, df in frames.items():
+    for idx, row in df.iterrows():
+      if row['Province/State'] != 'nan':
+        name = row['Country/Region']
+      else:
+        name = row['Province/State']
+      d = {}
+      d['name'] = name
+      d['lat'] = row['Lat']
+      d['lon'] = row['Long']
+      days = row.drop(['Province/State','Country/Region','Lat','Long'])
+      values = list(days.values)
+      d[c] = values
+      if c == 'confirmed':
+        d['size'] = update_dataset.get_size(values)
+      if name in data:
+        data[name][c] = values
+      else:
+        data[name] = d
+  return data
+
+def legacy_parse_states(df, states):
+  """
+  Reference implementation of the original per-state scan.
+  """
+  points = {}
+  max_len = 0;
+  for k, v in states.items():
+    data = {'name': k, 'lat': v['lat'], 'lon': v['lon'], 'confirmed':[],'deaths':[],'recovered':[]}
+    for i, row in df.iterrows():
+      if row['state'] == k:
+        data['confirmed'].append(row['cases'])
+        data['deaths'].append(row['deaths'])
+    data['size'] = update_dataset.get_size(data['confirmed'])
+    points[k] = data
+    max_len = max(max_len, len(data['confirmed']))
+  for k, v in points.items():
+    while len(v['confirmed']) < max_len:
+      v['confirmed'].insert(0,0)
+      v['deaths'].insert(0,0)
+  return points
+
+def bench_states(args):
+  df, states = synthetic.us_states(args.regions, args.days)
+  print('us-states: {} rows, {} states, {} days'.format(len(df), args.regions, args.days))
+  new_time, new = best_time(update_dataset.parse_states, df, states, repeat=args.repeat)
+  print('vectorized: {:.4f}s'.format(new_time))
+  if args.legacy:
+    old_time, old = best_time(legacy_parse_states, df, states, repeat=1)
+    print('legacy: {:.4f}s ({:.1f}x)'.format(old_time, old_time / new_time))
+    if old != new:
+      print('MISMATCH between legacy and vectorized output')
+      return 1
+    print('outputs match')
+  return 0
+
+def bench_countries(args):
+  frames = synthetic.global_series(args.regions, args.provinces, args.days)
+  print('global series: {} rows, {} days'.format(len(frames['confirmed']), args.days))
+  new_time, new = best_time(update_dataset.parse_countries, frames, repeat=args.repeat)
+  print('vectorized: {:.4f}s'.format(new_time))
+  df = frames['confirmed']
+  expected = df[df['Country/Region'] == synthetic.country_name(1)].iloc[:, -1].sum()
+  if new[synthetic.country_name(1)]['confirmed'][-1] != expected:
+    print('MISMATCH: provinces were not summed')
+    return 1
+  if args.legacy:
+    old_time, _ = best_time(legacy_parse_countries, frames, repeat=1)
+    print('legacy: {:.4f}s ({:.1f}x)'.format(old_time, old_time / new_time))
+  return 0
+
+def legacy_download_counties(raw):
+  df = pd.read_csv(raw['counties'])
+  df['date'] = pd.to_datetime(df['date'])
+  latest = df.loc[df['date'] == df['date'].max()]
+  data = {}
+  for i, row in latest.iterrows():
+    if row['state'] not in data:
+      data[row['state']] = {}
+    data[row['state']][row['county']] = {'confirmed':row['cases'],'deaths':row['deaths']}
+  df['deaths'] = df['deaths'].fillna(0)
+  table = df.groupby([update_dataset.county_keys(df), 'date'])[['cases','deaths']].sum().unstack('date')
+  series = {m: table[col].ffill(axis=1).fillna(0) for m, col in [('confirmed','cases'), ('deaths','deaths')]}
+  return data, series
+
+def peak_memory(fn, *args):
+  tracemalloc.start()
+  try:
+    result = fn(*args)
+    return tracemalloc.get_traced_memory()[1], result
+  finally:
+    tracemalloc.stop()
+
+def bench_counties(args):
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'us-counties.csv')
+    synthetic.us_counties(args.regions, args.counties, args.days).to_csv(path, index=False)
+    raw = {'counties': path}
+    print('us-counties: {:.1f} MB'.format(os.path.getsize(path) / 1e6))
+    # download_counties writes the counties store below resources/.
+    os.makedirs(os.path.join(directory, update_dataset.OUTPUT))
+    os.chdir(directory)
+    try:
+      new_time, new = best_time(update_dataset.download_counties, raw, repeat=args.repeat)
+      new_peak, _ = peak_memory(update_dataset.download_counties, raw)
+      counties = store.load_store(update_dataset.COUNTIES_STORE)
+    finally:
+      os.chdir(cwd)
+    print('streaming: {:.4f}s, peak {:.1f} MB'.format(new_time, new_peak / 1e6))
+    old_time, (old, series) = best_time(legacy_download_counties, raw, repeat=1)
+    old_peak, _ = peak_memory(legacy_download_counties, raw)
+    print('legacy: {:.4f}s ({:.1f}x), peak {:.1f} MB'.format(old_time, old_time / new_time, old_peak / 1e6))
+    for m, frame in series.items():
+      expected = frame.reindex(index=counties.regions, columns=counties.dates).to_numpy()
+      if not np.array_equal(counties.series[m], expected):
+        print('MISMATCH between legacy and streaming {} series'.format(m))
+        return 1
+  if old != new:
+    print('MISMATCH between legacy and streaming output')
+    return 1
+  print('outputs match')
+  return 0
+
+def bench_fetch(args):
+  with tempfile.TemporaryDirectory() as tmp:
+    served = os.path.join(tmp, 'served')
+    paths = synthetic.write_raw(served, days=args.days)
+    server = serve(served, args.latency)
+    mirror = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    total = sum(os.path.getsize(p) for p in paths.values())
+    print('{} sources, {:.1f} MB, {:.0f} ms latency'.format(len(paths), total / 1e6, args.latency * 1000))
+    timings = {}
+    for jobs in [1, len(update_dataset.SOURCES)]:
+      cache = os.path.join(tmp, 'cache{}'.format(jobs))
+      timings[jobs], raw = best_time(fetch.fetch_all, update_dataset.SOURCES, cache, jobs, 0, mirror, repeat=args.repeat)
+      for name, path in raw.items():
+        with open(path, 'rb') as a, open(paths[name], 'rb') as b:
+          if a.read() != b.read():
+            print('MISMATCH: {}'.format(name))
+            return 1
+      print('jobs={}: {:.4f}s'.format(jobs, timings[jobs]))
+    server.shutdown()
+  return 0
+
+def bench_store(args):
+  frames = synthetic.global_series(args.regions, 0, args.days)
+  points = update_dataset.parse_countries(frames)
+  dates = [c for c in frames['confirmed'].columns if c not in update_dataset.ignore]
+  with tempfile.TemporaryDirectory() as tmp:
+    json_path = os.path.join(tmp, 'Countries.json')
+    with open(json_path, 'w') as f:
+      json.dump(points, f)
+    store_path = os.path.join(tmp, 'Countries' + store.SUFFIX)
+    store.write_store(store_path, points, update_dataset.CASES, dates)
+    size = sum(os.path.getsize(os.path.join(store_path, f)) for f in os.listdir(store_path))
+    print('{} regions x {} days: json {:.1f} MB, store {:.1f} MB'.format(args.regions, args.days, os.path.getsize(json_path) / 1e6, size / 1e6))
+    results = {}
+    for fmt, path in [('json', json_path), ('store', store_path)]:
+      runs = [measure_load(path, fmt) for _ in range(args.repeat)]
+      results[fmt] = min(runs, key=lambda r: r['time'])
+      print('{}: {:.4f}s, +{} KB RSS'.format(fmt, results[fmt]['time'], results[fmt]['rss_kb']))
+    if results['json']['total'] != results['store']['total']:
+      print('MISMATCH between json and store totals')
+      return 1
+  return 0
+
+def bench_load(args):
+  frames = synthetic.global_series(args.regions, 0, args.days)
+  points = update_dataset.parse_countries(frames)
+  dates = [c for c in frames['confirmed'].columns if c not in update_dataset.ignore]
+  with tempfile.TemporaryDirectory() as tmp:
+    with open(os.path.join(tmp, 'Countries.json'), 'w') as f:
+      json.dump(points, f)
+    with open(os.path.join(tmp, 'populations.json'), 'w') as f:
+      json.dump({k: '{:,}'.format(1000000 + i) for i, k in enumerate(points)}, f)
+    print('{} regions x {} days'.format(args.regions, args.days))
+    def cold():
+      dataset.clear()
+      return dataset.points('Countries', tmp)
+    json_time, _ = best_time(cold, repeat=args.repeat)
+    print('json: {:.4f}s'.format(json_time))
+    store.write_store(os.path.join(tmp, 'Countries' + store.SUFFIX), points, update_dataset.CASES, dates)
+    store_time, _ = best_time(cold, repeat=args.repeat)
+    print('store: {:.4f}s'.format(store_time))
+    cached_time, loaded = best_time(dataset.points, 'Countries', tmp, repeat=args.repeat)
+    print('cached: {:.4f}s'.format(cached_time))
+    dataset.clear()
+  if any(list(loaded[k]['confirmed']) != points[k]['confirmed'] for k in points):
+    print('MISMATCH between loaded and parsed series')
+    return 1
+  return 0
+
+def per_region_linregress(matrix):
+  from scipy import stats
+  fits = []
+  for y in matrix:
+    days = np.nonzero(y > 0)[0]
+    fits.append(stats.linregress(days, np.log(y[days])))
+  return fits
+
+def bench_loglinear(args):
+  frames = synthetic.global_series(args.regions, 0, args.days)
+  matrix = frames['confirmed'].drop(columns=update_dataset.ignore).to_numpy()
+  print('{} regions x {} days'.format(args.regions, args.days))
+  new_time, fit = best_time(fitting.loglinear_fit, matrix, repeat=args.repeat)
+  print('batched: {:.4f}s'.format(new_time))
+  old_time, fits = best_time(per_region_linregress, matrix, repeat=args.repeat)
+  print('per region linregress: {:.4f}s ({:.1f}x)'.format(old_time, old_time / new_time))
+  if not np.allclose(fit['slope'], [f.slope for f in fits]):
+    print('MISMATCH between batched and per region slopes')
+    return 1
+  return 0
+
+def bench_sir(args):
+  points = run_sir.bundled_countries()
+  print('{} bundled countries'.format(len(points)))
+  fit = lambda: {k: run_sir.run_sir(p, 0, 1e9) for k, p in points.items()}
+  new_time, fits = best_time(fit, repeat=args.repeat)
+  print('in process: {:.4f}s'.format(new_time))
+  if not os.access(run_sir.SIR_MODEL, os.X_OK):
+    print('{} not built, skipping comparison'.format(run_sir.SIR_MODEL))
+    return 0
+  start = time.perf_counter()
+  failed = 0
+  for k, p in points.items():
+    try:
+      ref = run_sir.run_sir_binary(p, 0, 1e9)
+    except subprocess.CalledProcessError as e:
+      if e.returncode == 127:
+        print('{} cannot load its libraries, skipping comparison'.format(run_sir.SIR_MODEL))
+        return 0
+      print('sir_model failed with exit status {}'.format(e.returncode))
+      return 1
+    diff = run_sir.compare_sir(fits[k], ref)
+    if diff:
+      failed += 1
+      print('{}: {} differ, {} vs {}'.format(k, ', '.join(diff), fits[k], ref))
+  print('sir_model: {:.4f}s'.format(time.perf_counter() - start))
+  print('{} of {} fits match sir_model'.format(len(points) - failed, len(points)))
+  return 1 if failed else 0
+
+def loop_sir(s, ki, kr, i0, r0, days):
+  i = i0
+  r = r0
+  inf = []
+  for _ in range(days):
+    inf.append(i)
+    sp = -ki * i * s
+    ip = ki * i * s - kr * i
+    rp = kr * i
+    s += sp
+    i += ip
+    r += rp
+  return inf
+
+def bench_simulate(args):
+  n = int(round(args.scenarios ** (1 / 3)))
+  ki = np.linspace(1e-10, 5e-10, n)
+  kr = np.linspace(0.02, 0.2, n)
+  i0 = np.linspace(1, 100, n)
+  scenarios = n ** 3
+  print('{} scenarios x {} days'.format(scenarios, args.days))
+  out = simulate.allocate(scenarios, args.days)
+  run = lambda: simulate.sweep(1e9, ki, kr, i0, 0, args.days, out)
+  new_time, result = best_time(run, repeat=args.repeat)
+  print('vectorized: {:.4f}s ({:.0f} scenarios/s)'.format(new_time, scenarios / new_time))
+  loop = lambda: [loop_sir(1e9, a, b, c, 0, args.days)
+                  for a, b, c in zip(result.ki, result.kr, result.i0)]
+  old_time, trajectories = best_time(loop, repeat=args.repeat)
+  print('python loop: {:.4f}s ({:.1f}x)'.format(old_time, old_time / new_time))
+  if not np.allclose(result.trajectories.infected, trajectories):
+    print('MISMATCH between vectorized and looped trajectories')
+    return 1
+  return 0
+
+def legacy_growth_factor(values):
+  data = np.array(values)
+  d = data[1:] - data[:-1]
+  growth = d[1:]/d[:-1]
+  growth[np.isinf(growth)] = 0
+  growth[np.isnan(growth)] = 0
+  return growth.tolist()
+
+def per_region_metrics(series, population):
+  """
+  Derive the metrics one region at a time from lists, the way points were annotated before.
+
+  return(list): derived metrics of every region.
+  """
+  results = []
+  for i in range(len(population)):
+    row = {k: np.array([m[i].tolist()]) for k, m in series.items()}
+    derived = metrics.derive(row, population[i:i + 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+      derived['growth'] = legacy_growth_factor(series['confirmed'][i].tolist())
+    results.append(derived)
+  return results
+
+def bench_metrics(args):
+  print('{} days'.format(args.days))
+  for regions in [int(n) for n in args.regions.split(',')]:
+    frames = synthetic.global_series(regions, 0, args.days)
+    series = {k: f.drop(columns=update_dataset.ignore).to_numpy(dtype=np.int32) for k, f in frames.items()}
+    population = np.random.RandomState(0).randint(0, 10 ** 8, regions)
+    new_time, derived = best_time(metrics.derive, series, population, repeat=args.repeat)
+    old_time, looped = best_time(per_region_metrics, series, population, repeat=args.repeat)
+    print('{:>6} regions: vectorized {:.4f}s ({:.1f} us/region), per region {:.4f}s ({:.1f}x)'.format(
+      regions, new_time, new_time / regions * 1e6, old_time, old_time / new_time))
+    if not np.array_equal(derived['growth'], [r['growth'] for r in looped]):
+      print('MISMATCH between vectorized and per region growth factors')
+      return 1
+    for k in derived:
+      if k != 'growth' and not np.allclose(derived[k], [r[k][0] for r in looped], equal_nan=True):
+        print('MISMATCH between vectorized and per region {}'.format(k))
+        return 1
+  return 0
+
+ENTRY_POINTS = ['generate', 'update_dataset', 'run_sir', 'plot_data', 'benchmark']
+
+def import_times(module):
+  """
+  Import a module in a fresh interpreter with -X importtime.
+
+  return(tuple): (cumulative microseconds, {direct dependency: cumulative microseconds})
+  """
+  cwd = os.path.dirname(os.path.abspath(__file__))
+  out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                       cwd=cwd, capture_output=True, text=True)
+  total = None
+  children = {}
+  pending = {}
+  # Dependencies are listed before the module that imported them.
+  for line in out.stderr.splitlines():
+    if not line.startswith('import time:') or '|' not in line:
+      continue
+    _, cumulative, name = line.split('|')
+    if not cumulative.strip().isdigit():
+      continue
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    if depth == 0:
+      if name.strip() == module:
+        total, children = int(cumulative), pending
+      pending = {}
+    elif depth == 1:
+      pending[name.strip()] = int(cumulative)
+  if total is None:
+    raise RuntimeError('importing {} failed: {}'.format(module, out.stderr.strip().splitlines()[-1:]))
+  return total, children
+
+def bench_startup(args):
+  failed = 0
+  for module in args.modules or ENTRY_POINTS:
+    try:
+      runs = [import_times(module) for _ in range(args.repeat)]
+    except RuntimeError as e:
+      print(e)
+      failed += 1
+      continue
+    total, children = min(runs, key=lambda r: r[0])
+    heaviest = sorted(children.items(), key=lambda kv: -kv[1])[:args.top]
+    print('{}: {:.1f} ms ({})'.format(module, total / 1e3, ', '.join('{} {:.1f}'.format(k, v / 1e3) for k, v in heaviest)))
+  return 1 if failed else 0
+
+BASELINE = os.path.join('benchmarks', 'pipeline.json')
+
+def run_pipeline(args):
+  """
+  Run update_dataset, generate and plot_data against a synthetic workspace served
+  from a local mirror.
+
+  return(list): stage records, see instrument.report.
+  """
+  import generate
+  import plot_data
+  root = os.path.dirname(os.path.abspath(__file__))
+  cwd = os.getcwd()
+  template = generate.TEMPLATE
+  instrument.reset()
+  with tempfile.TemporaryDirectory() as tmp:
+    synthetic.write_workspace(tmp, args.regions, args.provinces, args.states, args.counties, args.days)
+    server = serve(os.path.join(tmp, 'upstream'))
+    mirror = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    generate.TEMPLATE = os.path.join(root, template)
+    os.chdir(tmp)
+    try:
+      with instrument.stage('update_dataset'):
+        update_dataset.main(['--mirror', mirror, '--force'])
+      dataset.clear()
+      with instrument.stage('generate'):
+        generate.main(['--savepath', 'docs', '--jobs', str(args.jobs), '--trend-cache', ''])
+      with instrument.stage('metrics'):
+        d = dataset.load('Countries')
+        metrics.derive(d.series, d.population)
+      if args.pdf:
+        with instrument.stage('plot_data'):
+          plot_data.main(['--savepath', tmp, '--output', 'report', '--jobs', str(args.jobs)])
+    finally:
+      os.chdir(cwd)
+      server.shutdown()
+      generate.TEMPLATE = template
+      dataset.clear()
+  return instrument.report()['stages']
+
+def compare_baseline(baseline, stages, tolerance):
+  """
+  Compare stage wall times with a stored baseline.
+
+  return(list): names of the stages slower than tolerance times the baseline.
+  """
+  slower = []
+  for s in stages:
+    before = baseline['stages'].get(s['name'])
+    if s.get('skipped') or not before:
+      continue
+    ratio = s['wall'] / before
+    flag = ''
+    # Stages this short are mostly timer noise.
+    if ratio > tolerance and s['wall'] - before > 0.01:
+      slower.append(s['name'])
+      flag = ' SLOWER'
+    print('{}: {:.3f}s vs {:.3f}s ({:.2f}x){}'.format(s['name'], s['wall'], before, ratio, flag))
+  return slower
+
+def bench_pipeline(args):
+  scale = {k: getattr(args, k) for k in ['regions', 'provinces', 'states', 'counties', 'days']}
+  print('{regions} regions x {provinces} provinces, {states} states x {counties} counties, {days} days'.format(**scale))
+  stages = run_pipeline(args)
+  for s in stages:
+    if not s.get('skipped'):
+      counters = ', '.join('{} {}'.format(k, v) for k, v in s['counters'].items())
+      print('{}: {:.3f}s wall, {:.3f}s cpu, {} MB peak RSS{}'.format(
+        s['name'], s['wall'], s['cpu'], s['peak_rss_kb'] // 1024, ', ' + counters if counters else ''))
+  failed = 0
+  if os.path.exists(args.baseline):
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    if baseline['scale'] != scale:
+      print('{} was recorded at a different scale {}, not comparing'.format(args.baseline, baseline['scale']))
+    else:
+      print('Compared to {} ({}):'.format(args.baseline, baseline['time']))
+      failed = len(compare_baseline(baseline, stages, args.tolerance))
+  if args.save:
+    os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+    with open(args.baseline, 'w') as f:
+      json.dump({
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'stages': {s['name']: s['wall'] for s in stages if not s.get('skipped')},
+      }, f, indent=2)
+    print(args.baseline)
+  return 1 if failed else 0
+
+def main(argv = sys.argv[1:]):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--repeat',type=int,default=3,help="runs per timing, best is reported")
+  sub = parser.add_subparsers(dest='bench')
+  sub.required = True
+  states = sub.add_parser('states', help="update_dataset.parse_states")
+  states.add_argument('--regions',type=int,default=56)
+  states.add_argument('--days',type=int,default=730)
+  states.add_argument('--nolegacy',dest='legacy',action='store_false',help="skip the original implementation")
+  states.set_defaults(func=bench_states)
+  countries = sub.add_parser('countries', help="update_dataset.parse_countries")
+  countries.add_argument('--regions',type=int,default=190)
+  countries.add_argument('--provinces',type=int,default=3)
+  countries.add_argument('--days',type=int,default=730)
+  countries.add_argument('--nolegacy',dest='legacy',action='store_false',help="skip the original implementation")
+  countries.set_defaults(func=bench_countries)
+  counties = sub.add_parser('counties', help="update_dataset.download_counties with the counties store vs reading the whole file")
+  counties.add_argument('--regions',type=int,default=56)
+  counties.add_argument('--counties',type=int,default=60)
+  counties.add_argument('--days',type=int,default=730)
+  counties.set_defaults(func=bench_counties)
+  fetch_parser = sub.add_parser('fetch', help="fetch.fetch_all against a local stand-in server")
+  fetch_parser.add_argument('--days',type=int,default=365)
+  fetch_parser.add_argument('--latency',type=float,default=0.2,help="seconds of simulated latency per response")
+  fetch_parser.set_defaults(func=bench_fetch)
+  store_parser = sub.add_parser('store', help="load time and RSS of Countries.json vs the columnar store")
+  store_parser.add_argument('--regions',type=int,default=190)
+  store_parser.add_argument('--days',type=int,default=1460)
+  store_parser.set_defaults(func=bench_store)
+  load = sub.add_parser('load', help="dataset.points from the JSON export, the store and the process cache")
+  load.add_argument('--regions',type=int,default=190)
+  load.add_argument('--days',type=int,default=730)
+  load.set_defaults(func=bench_load)
+  loglinear = sub.add_parser('loglinear', help="fitting.loglinear_fit vs per region linregress")
+  loglinear.add_argument('--regions',type=int,default=250)
+  loglinear.add_argument('--days',type=int,default=730)
+  loglinear.set_defaults(func=bench_loglinear)
+  sir_parser = sub.add_parser('sir', help="in process SIR fits vs sir_model on the bundled resources")
+  sir_parser.set_defaults(func=bench_sir)
+  simulate_parser = sub.add_parser('simulate', help="simulate.sweep vs one python loop per scenario")
+  simulate_parser.add_argument('--scenarios',type=int,default=1000,help="rounded to a cube of ki, kr and i0 values")
+  simulate_parser.add_argument('--days',type=int,default=365)
+  simulate_parser.set_defaults(func=bench_simulate)
+  metrics_parser = sub.add_parser('metrics', help="metrics.derive for all regions at once vs one region at a time")
+  metrics_parser.add_argument('--regions',type=str,default='50,250,1000,4000',help="comma separated region counts")
+  metrics_parser.add_argument('--days',type=int,default=730)
+  metrics_parser.set_defaults(func=bench_metrics)
+  startup = sub.add_parser('startup', help="import time of every entry point from -X importtime")
+  startup.add_argument('modules',nargs='*',help="modules to import, defaults to all entry points")
+  startup.add_argument('--top',type=int,default=3,help="number of heaviest direct imports to list")
+  startup.set_defaults(func=bench_startup)
+  pipeline = sub.add_parser('pipeline', help="update_dataset, generate and plot_data end to end on synthetic data")
+  pipeline.add_argument('--regions',type=int,default=190)
+  pipeline.add_argument('--provinces',type=int,default=3)
+  pipeline.add_argument('--states',type=int,default=56)
+  pipeline.add_argument('--counties',type=int,default=60,help="counties per state")
+  pipeline.add_argument('--days',type=int,default=730)
+  pipeline.add_argument('--jobs',type=int,default=os.cpu_count(),help="processes for trend fitting and PDF pages")
+  pipeline.add_argument('--nopdf',dest='pdf',action='store_false',help="skip the plot_data report")
+  pipeline.add_argument('--baseline',type=str,default=BASELINE,help="stored results to compare with")
+  pipeline.add_argument('--save',action='store_true',help="store these results as the baseline")
+  pipeline.add_argument('--tolerance',type=float,default=1.5,help="slowdown over the baseline that counts as a regression")
+  pipeline.set_defaults(func=bench_pipeline)
+  args = parser.parse_args(argv)
+  return args.func(args)
+
+if __name__ == '__main__':
+  sys.exit(main())
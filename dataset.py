@@ -0,0 +1,122 @@
+import json
+import os
+from collections import namedtuple
+import numpy as np
+import store
+
+RESOURCES = 'resources'
+POPULATIONS = os.path.join(RESOURCES, 'populations.json')
+METRICS = ['confirmed', 'deaths', 'recovered']
+
+Dataset = namedtuple('Dataset', ['regions', 'dates', 'series', 'meta', 'rows', 'groups', 'population'])
+
+_cache = {}
+
+def cached(key, load):
+  """
+  Get a value from the process cache, loading it on first use.
+
+  params:
+  key(tuple): cache key.
+  load(function): called without arguments on a miss.
+
+  return: cached value.
+  """
+  if key not in _cache:
+    _cache[key] = load()
+  return _cache[key]
+
+def clear():
+  _cache.clear()
+
+def parse_population(value):
+  """
+  Parse a population as stored in populations.json, e.g. '1,234' or 1234.
+
+  return(int): population, None if missing or not a number.
+  """
+  if isinstance(value, (int, np.integer)):
+    return int(value)
+  try:
+    return int(str(value).replace(',', ''))
+  except ValueError:
+    return None
+
+def load_populations(path = POPULATIONS):
+  """
+  Load populations keyed by region name, parsed once per process.
+
+  return(dict): int populations, regions that cannot be parsed are left out.
+  """
+  def load():
+    with open(path, 'r') as f:
+      raw = json.load(f)
+    populations = {k: parse_population(v) for k, v in raw.items()}
+    return {k: v for k, v in populations.items() if v is not None}
+  return cached(('populations', path), load)
+
+def from_points(points):
+  """
+  Build a store from points loaded from a JSON export.
+
+  return(store.Store): in-memory store with day offsets as dates.
+  """
+  names = list(points.keys())
+  metrics = [m for m in METRICS if any(m in p for p in points.values())]
+  days = max([len(p.get(m, [])) for p in points.values() for m in metrics] + [0])
+  series = {m: store.series_matrix(points, names, m, days) for m in metrics}
+  keys = []
+  for p in points.values():
+    keys += [k for k in p.keys() if k not in metrics and k not in keys]
+  meta = {k: [points[name].get(k) for name in names] for k in keys}
+  rows = {name: i for i, name in enumerate(names)}
+  return store.Store(names, list(range(days)), series, meta, rows, {})
+
+def load(name, resources = RESOURCES):
+  """
+  Load a series artifact into regions x dates matrices per metric with metadata and
+  population, parsed once per process. Reads the columnar store and falls back to
+  the JSON export.
+
+  params:
+  name(str): artifact name, e.g. Countries, States, World or Counties.
+  resources(str): resources directory.
+
+  return(Dataset): regions, dates, matrices keyed by metric, metadata, row and group
+  index and an int64 population array with 0 where it is unknown.
+  """
+  def read():
+    base = os.path.join(resources, name)
+    if os.path.exists(os.path.join(base + store.SUFFIX, store.INDEX)):
+      s = store.load_store(base + store.SUFFIX)
+    else:
+      with open(base + '.json', 'r') as f:
+        s = from_points(json.load(f))
+    populations = load_populations(os.path.join(resources, 'populations.json'))
+    population = np.array([populations.get(r, 0) for r in s.regions], dtype=np.int64)
+    return Dataset(s.regions, s.dates, s.series, s.meta, s.rows, s.groups, population)
+  return cached(('dataset', resources, name), read)
+
+def points(name, resources = RESOURCES):
+  """
+  Get the points of an artifact keyed by region name, with population set to an int
+  or 'N/A'. Series are row views of the cached matrices, the dicts are new on every
+  call so callers can annotate them.
+
+  return(dict): points.
+  """
+  d = load(name, resources)
+  result = store.to_points(store.Store(d.regions, d.dates, d.series, d.meta, d.rows, d.groups))
+  for p, population in zip(result.values(), d.population):
+    p['population'] = int(population) if population else 'N/A'
+  return result
+
+def legacy_frame(kind, resources = RESOURCES):
+  """
+  Load one of the legacy CSSE series CSVs (Confirmed, Deaths or Recovered), parsed
+  once per process.
+
+  return(pd.DataFrame): series frame, shared between callers so do not modify it.
+  """
+  import pandas as pd
+  return cached(('legacy', resources, kind), lambda: pd.read_csv(os.path.join(resources, kind + '.csv')))
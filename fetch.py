@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import fileutil
+import instrument
+import manifest
+
+Source = namedtuple('Source', ['name', 'url', 'filename', 'timeout'])
+CHUNK_SIZE = 1 << 16
+BACKOFF = 0.5
+
+def make_session(pool = 8):
+  """
+  Create a session whose connection pool is shared by all fetch threads.
+
+  params:
+  pool(int): maximum number of pooled connections per host.
+
+  return(requests.Session): session.
+  """
+  session = requests.Session()
+  adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+  session.mount('http://', adapter)
+  session.mount('https://', adapter)
+  return session
+
+def source_url(source, mirror = None):
+  """
+  Get the URL to fetch a source from.
+
+  params:
+  source(Source): source to fetch.
+  mirror(str): base URL of a stand-in server serving files by their cache filename.
+
+  return(str): URL.
+  """
+  if mirror:
+    return '{}/{}'.format(mirror.rstrip('/'), source.filename)
+  return source.url
+
+def meta_path(path):
+  return path + '.meta'
+
+def load_meta(path):
+  """
+  Load the cache metadata stored next to a raw file.
+
+  params:
+  path(str): raw file.
+
+  return(dict): url, etag, last_modified and sha256 of the cached response, empty if missing
+  or if it does not describe the file, e.g. after a crash between writing the two.
+  """
+  try:
+    with open(meta_path(path), 'r') as f:
+      meta = json.load(f)
+    st = os.stat(path)
+  except (OSError, ValueError):
+    return {}
+  if meta.get('size') != st.st_size or meta.get('mtime_ns') != st.st_mtime_ns:
+    return {}
+  return meta
+
+def digest(path):
+  """
+  Get the content hash of a raw file from its cache metadata, hashing the file when the
+  metadata is missing or stale.
+
+  params:
+  path(str): raw file.
+
+  return(str): hex SHA-256 digest.
+  """
+  meta = load_meta(path)
+  if 'sha256' in meta:
+    return meta['sha256']
+  return manifest.hash_file(path)
+
+def conditional_headers(url, path):
+  """
+  Get the validators to revalidate a cached response for the same URL.
+
+  return(dict): request headers.
+  """
+  meta = load_meta(path)
+  headers = {}
+  if meta.get('url') != url:
+    return headers
+  if meta.get('etag'):
+    headers['If-None-Match'] = meta['etag']
+  if meta.get('last_modified'):
+    headers['If-Modified-Since'] = meta['last_modified']
+  return headers
+
+def download(session, url, path, timeout):
+  """
+  Stream a URL to a file, replacing it only once the body is complete.
+  The cached copy is kept when the server reports it is not modified.
+
+  return(bool): True if new content was downloaded.
+  """
+  tmp = path + '.part'
+  headers = conditional_headers(url, path)
+  try:
+    with session.get(url, stream=True, timeout=timeout, headers=headers) as r:
+      if r.status_code == 304:
+        return False
+      r.raise_for_status()
+      h = hashlib.sha256()
+      with open(tmp, 'wb') as f:
+        for chunk in r.iter_content(CHUNK_SIZE):
+          h.update(chunk)
+          f.write(chunk)
+      meta = {
+        'url': url,
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'sha256': h.hexdigest(),
+      }
+    os.replace(tmp, path)
+  finally:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+  st = os.stat(path)
+  meta.update({'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+  fileutil.write_atomic(meta_path(path), json.dumps(meta))
+  instrument.count('bytes', st.st_size)
+  return True
+
+def fetch(session, source, cache_dir, retries = 3, mirror = None):
+  """
+  Download a source into the raw cache directory, retrying transient failures.
+
+  params:
+  session(requests.Session): shared session.
+  source(Source): source to fetch.
+  cache_dir(str): directory to store raw responses in.
+  retries(int): number of retries after the first attempt.
+  mirror(str): optional stand-in server base URL.
+
+  return(tuple): (path of the downloaded file, line to report for it)
+  """
+  url = source_url(source, mirror)
+  path = os.path.join(cache_dir, source.filename)
+  for attempt in range(retries + 1):
+    try:
+      if download(session, url, path, source.timeout):
+        return path, url
+      return path, '{} (not modified)'.format(url)
+    except requests.HTTPError as e:
+      if e.response.status_code < 500 or attempt == retries:
+        raise
+    # A body cut off mid-stream raises ChunkedEncodingError.
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+      if attempt == retries:
+        raise
+    time.sleep(BACKOFF * 2 ** attempt)
+
+def fetch_all(sources, cache_dir, jobs = 8, retries = 3, mirror = None):
+  """
+  Download all sources concurrently over one pooled session, reporting them in source
+  order once all are done so the lines of the threads do not interleave.
+
+  params:
+  sources(list): sources to fetch.
+  cache_dir(str): directory to store raw responses in.
+  jobs(int): number of concurrent downloads.
+  retries(int): number of retries per source.
+  mirror(str): optional stand-in server base URL.
+
+  return(dict): downloaded file paths keyed by source name.
+  """
+  os.makedirs(cache_dir, exist_ok=True)
+  session = make_session(jobs)
+  with ThreadPoolExecutor(max_workers=jobs) as pool:
+    futures = {s.name: pool.submit(fetch, session, s, cache_dir, retries, mirror) for s in sources}
+    results = {name: f.result() for name, f in futures.items()}
+  for _, line in results.values():
+    print(line)
+  return {name: path for name, (path, _) in results.items()}
@@ -0,0 +1,52 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+def current_umask():
+  mask = os.umask(0)
+  os.umask(mask)
+  return mask
+
+UMASK = current_umask()
+
+@contextmanager
+def atomic_open(path, mode = 'w', sync = False, **kwargs):
+  """
+  Open a temporary file next to path that replaces it only once the block completes,
+  so readers never see a partially written file. The temporary file is removed if the
+  block raises.
+
+  params:
+  path(str): destination file.
+  mode(str): 'w' or 'wb'.
+  sync(bool): flush the contents to disk before the rename, so the file also survives
+  a crash intact.
+
+  return(file): open temporary file.
+  """
+  directory = os.path.dirname(path) or '.'
+  fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+  try:
+    with os.fdopen(fd, mode, **kwargs) as f:
+      yield f
+      if sync:
+        f.flush()
+        os.fsync(f.fileno())
+    # mkstemp creates files readable by the owner only.
+    os.chmod(tmp, 0o666 & ~UMASK)
+    os.replace(tmp, path)
+  except BaseException:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    raise
+
+def write_atomic(path, data):
+  """
+  Replace a file with data in one step, see atomic_open.
+
+  params:
+  path(str): destination file.
+  data(str|bytes): contents.
+  """
+  with atomic_open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+    f.write(data)
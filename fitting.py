@@ -0,0 +1,78 @@
+import numpy as np
+
+def pad_series(series):
+  """
+  Stack series of different lengths into one matrix, padding on the right.
+
+  params:
+  series(list): values by day for each region.
+
+  return(tuple): (region x day float matrix, mask of the positions that hold data)
+  """
+  days = max([len(y) for y in series] + [0])
+  matrix = np.zeros((len(series), days))
+  valid = np.zeros((len(series), days), dtype=bool)
+  for i, y in enumerate(series):
+    matrix[i, :len(y)] = y
+    valid[i, :len(y)] = True
+  return matrix, valid
+
+def leading_mask(matrix):
+  """
+  Mask out leading zeros and any other non-positive values that cannot be logged.
+
+  params:
+  matrix(np.ndarray): region x day values.
+
+  return(np.ndarray): boolean mask of the usable values.
+  """
+  positive = np.asarray(matrix) > 0
+  return np.logical_or.accumulate(positive, axis=1) & positive
+
+def loglinear_fit(matrix, mask = None):
+  """
+  Fit log(y) = intercept + slope * x for every row at once by closed-form least squares.
+  x is the column index, so each row keeps its own day offsets when values are masked out.
+
+  params:
+  matrix(np.ndarray): region x day values, a single series is treated as one row.
+  mask(np.ndarray): values to fit, defaults to leading_mask(matrix).
+
+  return(dict): per row arrays of slope, intercept, r_value, r2, std_error, intercept_stderr
+  and n (number of fitted days). Rows with fewer than two usable values are NaN.
+  """
+  y = np.atleast_2d(np.asarray(matrix, dtype=float))
+  if mask is None:
+    mask = leading_mask(y)
+  mask = np.atleast_2d(mask) & (y > 0)
+  w = mask.astype(float)
+  x = np.arange(y.shape[1], dtype=float)[None, :]
+  log_y = np.log(np.where(mask, y, 1.0)) * w
+  with np.errstate(divide='ignore', invalid='ignore'):
+    n = w.sum(axis=1)
+    x_mean = (x * w).sum(axis=1) / n
+    y_mean = log_y.sum(axis=1) / n
+    dx = (x - x_mean[:, None]) * w
+    dy = (log_y - y_mean[:, None]) * w
+    sxx = (dx * dx).sum(axis=1)
+    sxy = (dx * dy).sum(axis=1)
+    syy = (dy * dy).sum(axis=1)
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    r = np.clip(sxy / np.sqrt(sxx * syy), -1, 1)
+    r2 = r * r
+    std_error = np.sqrt((1 - r2) * syy / sxx / (n - 2))
+    intercept_stderr = std_error * np.sqrt(sxx / n + x_mean ** 2)
+  invalid = n < 2
+  for v in [slope, intercept, r, r2]:
+    v[invalid] = np.nan
+  return {
+    'slope': slope,
+    'intercept': intercept,
+    'r_value': r,
+    'r2': r2,
+    'std_error': std_error,
+    'intercept_stderr': intercept_stderr,
+    'x_mean': x_mean,
+    'n': n,
+  }
@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
+import itertools
+import hashlib
 import json
+import multiprocessing
+import signal
 import numpy as np
 import sys
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from datetime import datetime
 from jinja2 import Template
+import dataset
+import fileutil
+import fitting
+import instrument
+import manifest
+import metrics
 
 TEMPLATE = "template.tpl"
+DATA_DIR = 'data'
+SIR_RESULTS = os.path.join('resources','SIR.json')
+RENDER_BUFFER = 64
+MANIFEST = os.path.join('resources','build.json')
+DASHBOARD_INPUTS = ['Countries.json', 'States.json', 'World.json', 'populations.json', 'SIR.json']
+TREND_CACHE = os.path.join('resources','trends.json')
 
 def logistic_growth(x, maximum, rate, center, offset):
   return maximum / (1 + np.exp(-rate*(x-center))) + offset;
@@ -19,55 +33,194 @@ def logistic_growth(x, maximum, rate, center, offset):
 def exponential_growth(x,initial_pop,r, a):
   return initial_pop * ((1 + r)**(x-a))
 
-def growth_factor(dataset):
+class FitTimeout(Exception):
+  pass
+
+def raise_timeout(signum, frame):
+  raise FitTimeout()
+
+def failed_trends():
+  return {'log_terms': [], 'log_cov': []}
+
+TERMS = ['log_terms', 'log_cov']
+
+def exponential_trends(series):
+  """
+  Fit every series to an exponential trend at once. exponential_growth is linear in log space,
+  log(y) = log(P0) + (x - a) * log(1 + r), so all series are solved by one closed-form
+  log-linear regression with a fixed at 1.
+
+  params:
+  series(list): cases by day for each point.
+
+  return(list): exp_terms and exp_cov for each series, empty where there is nothing to fit.
+  """
+  matrix, valid = fitting.pad_series(series)
+  fit = fitting.loglinear_fit(matrix, fitting.leading_mask(matrix) & valid)
+  slope = fit['slope']
+  p0 = np.exp(fit['intercept'] + slope)
+  rate = np.exp(slope) - 1
+  # Propagate the covariance of (slope, intercept) to (P0, r).
+  var_s = fit['std_error'] ** 2
+  var_c = fit['intercept_stderr'] ** 2
+  cov_sc = -fit['x_mean'] * var_s
+  var_p0 = p0 * p0 * (var_s + 2 * cov_sc + var_c)
+  var_r = np.exp(2 * slope) * var_s
+  cov_p0r = p0 * np.exp(slope) * (var_s + cov_sc)
+  results = []
+  for i in range(len(series)):
+    if not np.isfinite([p0[i], rate[i]]).all():
+      results.append({'exp_terms': [], 'exp_cov': []})
+      continue
+    cov = np.zeros((3, 3))
+    cov[:2, :2] = [[var_p0[i], cov_p0r[i]], [cov_p0r[i], var_r[i]]]
+    cov = cov.tolist() if np.isfinite(cov).all() else []
+    results.append({'exp_terms': [float(p0[i]), float(rate[i]), 1.0], 'exp_cov': cov})
+  return results
+
+def clip_terms(p0, lower, upper):
+  if not p0:
+    return None
+  return np.clip(p0, lower, upper).tolist()
+
+def fit_trends(y, timeout = None, p0 = None):
   """
-  Get the current growth factor for a dataset.
-  dN/dN-1
+  Fit a series to a logistic trend.
 
   params:
-  dataset(list): list of cases by day.
+  y(list): cases by day.
+  timeout(float): seconds before the fit is abandoned, None to wait forever.
+  p0(dict): previous log_terms to start the fit from.
 
-  return(list): growth factor over time.
+  return(dict): trend terms and covariance, empty terms if the fit failed,
+  or None if it timed out.
   """
-  data = np.array(dataset)
-  d = data[1:] - data[:-1]
-  growth = d[1:]/d[:-1]
-  growth[np.isinf(growth)] = 0
-  growth[np.isnan(growth)] = 0
-  return growth.tolist()
+  # Imported here so --notrends does not pay for scipy.
+  from scipy.optimize import curve_fit
+  alarm = timeout and hasattr(signal, 'setitimer')
+  if alarm:
+    signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+  p0 = p0 or {}
+  try:
+    x = range(len(y))
+    log_bounds = ([max(y),0,x[0],0],[1e9,10,x[-1] * 1.2,10])
+    log_opt, log_cov = curve_fit(logistic_growth, x, y, p0 = clip_terms(p0.get('log_terms'), *log_bounds), bounds = log_bounds)
+    return {
+      'log_terms': log_opt.tolist(),
+      'log_cov': log_cov.tolist(),
+    }
+  except FitTimeout:
+    return None
+  except:
+    return failed_trends()
+  finally:
+    if alarm:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+
+def fit_task(task, timeout = None):
+  y, p0 = task
+  return fit_trends(y, timeout, p0)
+
+def series_hash(y):
+  return hashlib.sha1(np.asarray(y, dtype=np.int64).tobytes()).hexdigest()
+
+def load_trend_cache(path):
+  """
+  Load fitted trends from previous runs.
+
+  params:
+  path(str): cache file, None to disable caching.
+
+  return(dict): cache entries keyed by point name, empty if the cache is missing or unreadable.
+  """
+  if not path:
+    return {}
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def save_trend_cache(path, cache):
+  if not path:
+    return
+  with fileutil.atomic_open(path, 'w') as f:
+    json.dump(cache, f)
 
-def calculate_trends(points):
+def lookup_trends(entry, y):
+  """
+  Look up a series in the trend cache.
+
+  params:
+  entry(dict): cache entry for the point, None if there is none.
+  y(np.ndarray): cases by day.
+
+  return(tuple): (cached result if the series is unchanged, previous terms to warm start from if
+  the series only had days appended)
+  """
+  if entry is None:
+    return None, None
+  n = entry['length']
+  if n == len(y) and entry['hash'] == series_hash(y):
+    return {k: entry[k] for k in TERMS}, None
+  if n < len(y) and entry['log_terms'] and entry['hash'] == series_hash(y[:n]):
+    return None, {'log_terms': entry['log_terms']}
+  return None, None
+
+def calculate_trends(points, jobs = 1, timeout = None, cache = None):
   """
   Fit data to both an exponential trend and a logistic trend and save data to corresponding point.
+  Exponential trends are solved for all points at once. Logistic fits are spread across a process
+  pool and applied in point order. Points whose series are unchanged reuse the cached fit and points
+  that only had days appended start from the cached terms.
 
   params:
   points(list): list of points.
+  jobs(int): number of worker processes.
+  timeout(float): seconds per fit before the point is marked N/A.
+  cache(dict): trend cache to read and update, None to always fit from scratch.
 
-  return(None):
+  return(dict): number of cache hits, warm starts and misses.
   """
   print("Calculating Trend Lines",end='', flush=True)
-  for k, point in points.items():
-    # Calculate growth rates if enabled.
-    y = point['confirmed']
-    x = range(len(y))
-    try:
-      log_opt, log_cov = curve_fit(logistic_growth, x, y , bounds = ([max(y),0,x[0],0],[1e9,10,x[-1] * 1.2,10]))
-      exp_opt, exp_cov = curve_fit(exponential_growth, x, y, bounds = ([1,0,1],[200,1,100]))
-
-      point['log_terms'] = log_opt.tolist()
-      point['log_cov'] = log_cov.tolist()
-      point['exp_terms'] = exp_opt.tolist()
-      point['exp_cov'] = exp_cov.tolist()
-      point['growth'] = growth_factor(y)
-      print('.',end='', flush=True)
-
-    except:
-      point['growth'] = 'N/A'
-      point['log_terms'] = []
-      point['log_cov'] = []
-      point['exp_terms'] = []
-      point['exp_cov'] = []
+  stats = {'hits': 0, 'warm': 0, 'misses': 0}
+  keys = list(points.keys())
+  series = {k: np.asarray(points[k]['confirmed']) for k in keys}
+  results = {}
+  tasks = []
+  for k in keys:
+    hit, p0 = lookup_trends(cache.get(k) if cache is not None else None, series[k])
+    if hit is not None:
+      results[k] = hit
+      stats['hits'] += 1
+      if hit['log_terms']:
+        print('.',end='', flush=True)
+    else:
+      tasks.append((k, p0))
+      stats['warm' if p0 else 'misses'] += 1
+  fit = functools.partial(fit_task, timeout=timeout)
+  pool = multiprocessing.Pool(jobs) if jobs > 1 and tasks else None
+  try:
+    todo = [(series[k], p0) for k, p0 in tasks]
+    fitted = pool.imap(fit, todo) if pool else map(fit, todo)
+    for (k, _), result in zip(tasks, fitted):
+      if result is not None and cache is not None:
+        entry = {t: result[t] for t in TERMS}
+        entry.update({'length': len(series[k]), 'hash': series_hash(series[k])})
+        cache[k] = entry
+      results[k] = result or failed_trends()
+      if results[k]['log_terms']:
+        print('.',end='', flush=True)
+  finally:
+    if pool:
+      pool.terminate()
+  exponential = exponential_trends([series[k] for k in keys])
+  for k, exp in zip(keys, exponential):
+    points[k].update(results[k])
+    points[k].update(exp)
   print('Done!')
+  return stats
 
 def load_template():
   """
@@ -81,10 +234,20 @@ def load_template():
 
 def save_html(filename, html):
   """
-  Save HTML to file
+  Save HTML to file, replacing it atomically so a half written dashboard is never served.
+
+  params:
+  filename(str): output file.
+  html(str|jinja2.environment.TemplateStream): page, or a stream that is rendered while writing.
+
+  return(int): characters written.
   """
-  with open(filename, "w") as f:
-    f.write(html)
+  with fileutil.atomic_open(filename, "w") as f:
+    if isinstance(html, str):
+      f.write(html)
+    else:
+      html.dump(f)
+    return f.tell()
 
 def get_num_days(data):
   """
@@ -106,59 +269,259 @@ def get_total(data):
   """
   total = 0;
   for k,v in data.items():
-    total+=v['confirmed'][-1]
+    total+=int(v['confirmed'][-1])
   return total
 
-def fill_populations(l):
-  path = os.path.join('resources', 'populations.json')
+def attach_sir(points, path = SIR_RESULTS):
+  """
+  Attach the SIR parameters fitted by run_sir.py --all to their points, failed fits are left out.
+
+  params:
+  points(dict): points keyed by name.
+  path(str): results file, skipped if it does not exist.
+  """
+  if not os.path.exists(path):
+    return
   with open(path, 'r') as f:
-    j = json.loads(f.read())
-  for k,v in l.items():
-    try:
-      v['population'] = j[k]
-    except:
-      v['population'] = 'N/A'
+    results = json.load(f)
+  for k, v in points.items():
+    if k in results and results[k].get('status') == 'ok':
+      v['sir'] = results[k]
 
 def get_world_point():
-  path = os.path.join('resources','World.json')
-  with open(path, 'r') as f:
-    data = json.load(f)
-  return data
+  return dataset.points('World')
 
 def get_country_points():
-  path = os.path.join('resources','Countries.json')
-  with open(path, 'r') as f:
-    data = json.load(f)
-  return data
+  return dataset.points('Countries')
 
 def get_state_points():
-  path = os.path.join('resources','States.json')
-  with open(path, 'r') as f:
-    data = json.load(f)
-  return data
+  return dataset.points('States')
+
+def attach_metrics(points, name):
+  """
+  Attach growth factor, daily new cases, rolling average, doubling time, case fatality rate
+  and cases per capita to the points of an artifact, computed for all regions at once.
+
+  params:
+  points(dict): points of the artifact keyed by region name.
+  name(str): artifact name, e.g. Countries.
+  """
+  d = dataset.load(name)
+  metrics.attach(points, d.regions, metrics.derive(d.series, d.population))
+
+def delta_encode(values):
+  """
+  Delta-encode a cumulative series, the first value is kept as is.
+
+  return(list): day over day differences.
+  """
+  return np.diff(np.asarray(values, dtype=np.int64), prepend=0).tolist()
+
+def last_value(values):
+  return int(values[-1]) if len(values) else None
+
+LATEST_METRICS = ['daily_avg', 'doubling_time', 'cfr', 'per_capita']
+
+JSON_ENCODER = json.JSONEncoder(separators=(',',':'))
+
+def to_json(data):
+  return JSON_ENCODER.encode(data)
+
+def region_index(point, region_id, version):
+  """
+  Get the fields of a point that the map needs before a region is selected.
+
+  return(dict): index entry.
+  """
+  entry = {
+    'id': region_id,
+    'v': version,
+    'name': point['name'],
+    'lat': point['lat'],
+    'lon': point['lon'],
+    'size': point['size'],
+    'population': point.get('population'),
+    'total_confirmed': last_value(point['confirmed']),
+    'total_deaths': last_value(point['deaths']),
+    'total_recovered': last_value(point['recovered']),
+  }
+  for k in ['exp_terms', 'log_terms', 'sir']:
+    if k in point:
+      entry[k] = point[k]
+  for k in LATEST_METRICS:
+    if k in point:
+      entry[k] = metrics.latest(point[k])
+  return entry
+
+def region_series(point):
+  """
+  Get the per-day data of a point, loaded by the dashboard when the region is selected.
+
+  return(dict): delta-encoded series, growth factor and counties.
+  """
+  series = {k: delta_encode(point[k]) for k in ['confirmed', 'deaths', 'recovered']}
+  growth = point.get('growth')
+  if growth is not None:
+    growth = [round(g, 4) for g in np.asarray(growth).tolist()]
+  series['growth_factor'] = growth
+  if 'counties' in point:
+    series['counties'] = point['counties']
+  return series
+
+def write_payload(points, savepath):
+  """
+  Write the dashboard data next to index.html: a small index of every region in data/index.js
+  and one delta-encoded series file per region in data/series/<id>.js. The files are scripts
+  rather than JSON so the dashboard also works when opened from disk.
+
+  params:
+  points(dict): points keyed by name.
+  savepath(str): dashboard directory.
+
+  return(tuple): (index script path relative to savepath, index bytes, total series bytes)
+  """
+  series_dir = os.path.join(savepath, DATA_DIR, 'series')
+  os.makedirs(series_dir, exist_ok=True)
+  index = {}
+  written = set()
+  series_bytes = 0
+  for i, (k, point) in enumerate(points.items()):
+    body = 'seriesLoaded({},{});\n'.format(i, to_json(region_series(point)))
+    version = hashlib.sha1(body.encode()).hexdigest()[:10]
+    name = '{}.js'.format(i)
+    fileutil.write_atomic(os.path.join(series_dir, name), body)
+    written.add(name)
+    series_bytes += len(body)
+    index[k] = region_index(point, i, version)
+  for name in os.listdir(series_dir):
+    if name not in written:
+      os.remove(os.path.join(series_dir, name))
+  # Serialize the index in chunks rather than building it as one string.
+  h = hashlib.sha1()
+  size = 0
+  with fileutil.atomic_open(os.path.join(savepath, DATA_DIR, 'index.js'), 'w') as f:
+    for chunk in itertools.chain(['var all_data = '], JSON_ENCODER.iterencode(index), [';\n']):
+      f.write(chunk)
+      h.update(chunk.encode())
+      size += len(chunk)
+  return '{}/index.js?v={}'.format(DATA_DIR, h.hexdigest()[:10]), size, series_bytes
+
+# Derived metrics the inlined page never carried, growth was inlined.
+NOT_INLINED = ['daily_new', 'daily_avg', 'doubling_time', 'cfr', 'per_capita']
+
+def inline_size(points):
+  """
+  Get the size of the dataset when inlined into index.html as a Python literal, with the
+  fields the inlined page carried.
+
+  return(int): bytes.
+  """
+  return len(repr({k: {f: v.tolist() if isinstance(v, np.ndarray) else v for f, v in p.items() if f not in NOT_INLINED}
+                   for k, p in points.items()}))
 
 def main(argv = sys.argv[1:]):
   parser = argparse.ArgumentParser()
   parser.add_argument('--savepath',type=str,default='docs',help="path to save html dashboard")
   parser.add_argument('--trends',dest='trends', action='store_true', help="enable trend calculation")
   parser.add_argument('--notrends',dest='trends', action='store_false', help="enable trend calculation")
+  parser.add_argument('--jobs',type=int,default=os.cpu_count(),help="number of processes for trend fitting")
+  parser.add_argument('--fit-timeout',dest='fit_timeout',type=float,default=30,help="seconds per trend fit before it is marked N/A")
+  parser.add_argument('--trend-cache',dest='trend_cache',type=str,default=TREND_CACHE,help="file to cache fitted trends in, empty to disable")
+  parser.add_argument('--report-payload',dest='report_payload',action='store_true',help="compare the payload size with inlining the dataset")
+  parser.add_argument('--force',action='store_true',help="rebuild the dashboard even if its inputs are unchanged")
+  parser.add_argument('--report',type=str,default=None,help="write stage timings, memory and counters to this JSON file")
+  parser.add_argument('--profile',type=str,default=None,help="directory to write a cProfile dump per stage to")
   parser.set_defaults(trends=True)
   args = parser.parse_args(argv)
-  tpl = load_template()
-  countries = get_country_points()
-  states = get_state_points()
-  world = get_world_point()
-  points_dict = {**countries, **states, **world}
-  fill_populations(points_dict)
+  instrument.configure(args.profile)
+  try:
+    build(args)
+  finally:
+    if args.report:
+      instrument.save_report(args.report)
+
+def hash_optional(path):
+  return manifest.hash_file(path) if os.path.exists(path) else None
+
+def dashboard_inputs(args):
+  """
+  Get the content hashes of the resources the dashboard data is built from, plus the
+  options that change it.
+
+  return(dict): inputs for manifest.is_current.
+  """
+  inputs = {name: hash_optional(os.path.join('resources', name)) for name in DASHBOARD_INPUTS}
+  inputs['options'] = {'trends': args.trends, 'fit_timeout': args.fit_timeout}
+  return inputs
+
+def build(args):
+  # The manifest is shared with update_dataset.py, so it is loaded even when forced.
+  built = manifest.load_manifest(MANIFEST)
+  data_stage = 'dashboard:{}'.format(args.savepath)
+  page_stage = 'page:{}'.format(args.savepath)
+  inputs = dashboard_inputs(args)
+  outputs = [os.path.join(args.savepath, DATA_DIR, 'index.js')]
+  context = manifest.context(built, data_stage)
+  if context and not args.force and not args.report_payload and manifest.is_current(built, data_stage, inputs, outputs):
+    print('dashboard data unchanged, skipping')
+    instrument.skip('payload')
+  else:
+    context = build_data(args)
+    manifest.record(built, data_stage, inputs, context)
+  output_file = os.path.join(args.savepath,'index.html')
+  page_inputs = {'template': manifest.hash_file(TEMPLATE), 'context': hashlib.sha1(json.dumps(context, sort_keys=True).encode()).hexdigest()}
+  if not args.force and manifest.is_current(built, page_stage, page_inputs, [output_file]):
+    print('{} unchanged, skipping'.format(output_file))
+    instrument.skip('render')
+  else:
+    tpl = load_template()
+    # The template is rendered while it is written, so both are one stage.
+    with instrument.stage('render'):
+      html = tpl.stream(**context)
+      html.enable_buffering(RENDER_BUFFER)
+      instrument.count('bytes', save_html(output_file, html))
+    manifest.record(built, page_stage, page_inputs)
+    print('Saved: {}'.format(output_file))
+  manifest.save_manifest(MANIFEST, built)
+
+def build_data(args):
+  """
+  Load the resources, fit trends and write the dashboard data.
+
+  return(dict): template render context.
+  """
+  with instrument.stage('load'):
+    countries = get_country_points()
+    states = get_state_points()
+    world = get_world_point()
+    points_dict = {**countries, **states, **world}
+    attach_sir(points_dict)
+    instrument.count('rows', len(points_dict))
+  with instrument.stage('metrics'):
+    for name, points in [('Countries', countries), ('States', states), ('World', world)]:
+      attach_metrics(points, name)
   # Calculate trends.
+  stats = None
   if args.trends:
-    calculate_trends(points_dict)
-  html = tpl.render(points_dict=points_dict, days = get_num_days(points_dict))
-  output_file = os.path.join(args.savepath,'index.html')
-  save_html(output_file, html)
+    with instrument.stage('trends'):
+      cache = load_trend_cache(args.trend_cache)
+      stats = calculate_trends(points_dict, args.jobs, args.fit_timeout, cache if args.trend_cache else None)
+      save_trend_cache(args.trend_cache, cache)
+      instrument.count('rows', len(points_dict))
+      for k, v in stats.items():
+        instrument.count(k, v)
+  with instrument.stage('payload'):
+    index_url, index_bytes, series_bytes = write_payload(points_dict, args.savepath)
+    instrument.count('bytes', index_bytes + series_bytes)
+  if args.report_payload:
+    before = inline_size(points_dict)
+    print('Payload: {:.1f} KB inlined -> {:.1f} KB index + {:.1f} KB series in {} files'.format(
+      before / 1e3, index_bytes / 1e3, series_bytes / 1e3, len(points_dict)))
   cases = get_total(countries)
-  print('Saved: {}'.format(output_file))
   print('Total cases: {}'.format(cases))
+  if stats:
+    print('Trend cache: {hits} hits, {warm} warm starts, {misses} misses'.format(**stats))
+  return {'index_url': index_url, 'regions': list(points_dict.keys()), 'days': get_num_days(points_dict)}
 
 if __name__ == '__main__':
   np.seterr(divide='ignore', invalid='ignore')
@@ -0,0 +1,190 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_stages = []
+_current = []
+_settings = {'profile_dir': None, 'start': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def configure(profile_dir = None):
+  """
+  Set up instrumentation for this run.
+
+  params:
+  profile_dir(str): directory to write one cProfile dump per stage to, None to disable.
+  """
+  _settings['profile_dir'] = profile_dir
+  if profile_dir:
+    os.makedirs(profile_dir, exist_ok=True)
+
+def proc_status(field):
+  """
+  Read a memory field of /proc/self/status.
+
+  return(int): kilobytes, None where /proc is not available.
+  """
+  try:
+    with open('/proc/self/status', 'r') as f:
+      for line in f:
+        if line.startswith(field + ':'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  return None
+
+def peak_rss_kb():
+  """
+  Get the peak resident set size of this process since start or the last reset_peak.
+
+  return(int): kilobytes, from /proc when available since ru_maxrss is not always filled in.
+  """
+  peak = proc_status('VmHWM')
+  if peak is not None:
+    return peak
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS reports bytes.
+  return peak // 1024 if sys.platform == 'darwin' else peak
+
+def rss_kb():
+  """
+  Get the current resident set size of this process.
+
+  return(int): kilobytes, the peak where the current size is not available.
+  """
+  rss = proc_status('VmRSS')
+  return peak_rss_kb() if rss is None else rss
+
+def reset_peak():
+  """
+  Reset the peak resident set size to the current size, on Linux only.
+
+  return(bool): True if the peak was reset.
+  """
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+    return True
+  except OSError:
+    return False
+
+def fold_peak():
+  """
+  Raise the peak of every running stage to the peak since the last reset. Called with
+  the lock held before the peak is reset or a stage ends.
+  """
+  peak = peak_rss_kb()
+  for record in _current:
+    record['peak_rss_kb'] = max(record['peak_rss_kb'], peak)
+
+def cpu_time():
+  """
+  Get the CPU time used by this process and its finished children, e.g. pool workers.
+
+  return(float): seconds.
+  """
+  total = 0.0
+  for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]:
+    usage = resource.getrusage(who)
+    total += usage.ru_utime + usage.ru_stime
+  return total
+
+def count(key, n):
+  """
+  Add to a counter of the innermost running stage, e.g. bytes or rows.
+  Safe to call from threads, ignored outside of a stage.
+  """
+  with _lock:
+    if _current:
+      counters = _current[-1]['counters']
+      counters[key] = counters.get(key, 0) + int(n)
+
+def skip(name):
+  """
+  Record a stage that did not run because its inputs were unchanged.
+  """
+  with _lock:
+    _stages.append({'name': name, 'skipped': True})
+
+@contextmanager
+def stage(name):
+  """
+  Record wall time, CPU time, memory and counters of a pipeline stage, profiling it
+  if a profile directory is configured. The peak RSS of a stage is its own: the high
+  water mark is reset when a stage starts and folded into the running stages first,
+  where it cannot be reset the peak is that of the process so far. The RSS growth is
+  the change in resident size over the stage.
+
+  params:
+  name(str): stage name, nested stages are recorded as parent/child.
+  """
+  with _lock:
+    path = '/'.join(([_current[-1]['name']] if _current else []) + [name])
+    nested = bool(_current)
+    fold_peak()
+    reset_peak()
+    start_rss = rss_kb()
+    record = {'name': path, 'counters': {}, 'peak_rss_kb': start_rss}
+    _current.append(record)
+  profiler = None
+  # Only one profiler can be active, nested stages are part of their parent's dump.
+  if _settings['profile_dir'] and not nested:
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+  wall = time.perf_counter()
+  cpu = cpu_time()
+  try:
+    yield record
+  finally:
+    record['wall'] = round(time.perf_counter() - wall, 6)
+    record['cpu'] = round(cpu_time() - cpu, 6)
+    if profiler:
+      profiler.disable()
+      profiler.dump_stats(os.path.join(_settings['profile_dir'], path.replace('/', '.') + '.prof'))
+    with _lock:
+      fold_peak()
+      record['rss_growth_kb'] = rss_kb() - start_rss
+      _current.remove(record)
+      _stages.append(record)
+
+def reset():
+  """
+  Forget the stages recorded so far and restart the run.
+  """
+  with _lock:
+    del _stages[:]
+    _settings['start'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+def report():
+  """
+  Get the run report.
+
+  return(dict): command line, start time, peak RSS of the process and the records of
+  every stage in completion order.
+  """
+  with _lock:
+    fold_peak()
+    return {
+      'argv': sys.argv,
+      'time': _settings['start'],
+      'peak_rss_kb': max([peak_rss_kb()] + [s['peak_rss_kb'] for s in _stages if 'peak_rss_kb' in s]),
+      'stages': list(_stages),
+    }
+
+def save_report(path):
+  """
+  Write the run report as JSON.
+
+  params:
+  path(str): report file, its directory is created if needed.
+  """
+  if os.path.dirname(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'w') as f:
+    json.dump(report(), f, indent=2)
+  print(path)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import fileutil
+
+CHUNK_SIZE = 1 << 16
+
+def hash_file(path):
+  """
+  Get the SHA-256 content hash of a file.
+
+  params:
+  path(str): file to hash.
+
+  return(str): hex digest.
+  """
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+      h.update(chunk)
+  return h.hexdigest()
+
+def load_manifest(path):
+  """
+  Load the input hashes recorded by the last build.
+
+  params:
+  path(str): manifest file.
+
+  return(dict): recorded inputs keyed by stage name, empty if there is no manifest.
+  """
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def save_manifest(path, manifest):
+  with fileutil.atomic_open(path, 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+
+def is_current(manifest, stage, inputs, outputs = []):
+  """
+  Check whether a stage was last built from the same inputs and its outputs still exist.
+
+  params:
+  manifest(dict): loaded manifest.
+  stage(str): stage name.
+  inputs(dict): input hashes keyed by input name.
+  outputs(list): files the stage writes.
+
+  return(bool): True if the stage can be skipped.
+  """
+  return manifest.get(stage) == inputs and all(os.path.exists(o) for o in outputs)
+
+def record(manifest, stage, inputs, context = None):
+  """
+  Record the inputs a stage was built from.
+
+  params:
+  manifest(dict): loaded manifest.
+  stage(str): stage name.
+  inputs(dict): input hashes keyed by input name.
+  context(dict): optional results of the stage that later stages need when it is skipped.
+  """
+  manifest[stage] = dict(inputs)
+  if context is not None:
+    manifest[stage + ':context'] = context
+
+def context(manifest, stage):
+  """
+  Get the context recorded with a stage.
+
+  return(dict): context, None if none was recorded.
+  """
+  return manifest.get(stage + ':context')
@@ -0,0 +1,143 @@
+import numpy as np
+
+WINDOW = 7
+PER_CAPITA = 100000
+
+def daily_new(matrix):
+  """
+  Get new cases per day from cumulative series, the first day is kept as is.
+
+  params:
+  matrix(np.ndarray): regions x days cumulative counts.
+
+  return(np.ndarray): regions x days int64 matrix.
+  """
+  return np.diff(np.asarray(matrix, dtype=np.int64), axis=1, prepend=0)
+
+def growth_factor(matrix):
+  """
+  Get the growth factor of every region over time.
+  dN/dN-1, 0 where the previous day had no new cases.
+
+  params:
+  matrix(np.ndarray): regions x days cumulative counts.
+
+  return(np.ndarray): regions x (days - 2) float matrix.
+  """
+  d = np.diff(np.asarray(matrix, dtype=np.int64), axis=1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    growth = d[:, 1:] / d[:, :-1]
+  growth[~np.isfinite(growth)] = 0
+  return growth
+
+def rolling_mean(matrix, window = WINDOW):
+  """
+  Get the trailing mean of every region over a window of days, the first days are averaged
+  over the days available.
+
+  params:
+  matrix(np.ndarray): regions x days values, e.g. from daily_new.
+  window(int): days to average over.
+
+  return(np.ndarray): regions x days float matrix.
+  """
+  m = np.asarray(matrix, dtype=float)
+  total = np.cumsum(m, axis=1)
+  total[:, window:] -= total[:, :-window].copy()
+  return total / np.minimum(np.arange(1, m.shape[1] + 1), window)
+
+def doubling_time(matrix, window = WINDOW):
+  """
+  Get the days it takes cases to double at the growth rate over the last window of days.
+
+  params:
+  matrix(np.ndarray): regions x days cumulative counts.
+  window(int): days to measure growth over.
+
+  return(np.ndarray): regions x days float matrix, NaN for the first window of days, where
+  there were no cases a window earlier and where cases did not grow.
+  """
+  m = np.asarray(matrix, dtype=float)
+  result = np.full(m.shape, np.nan)
+  before = m[:, :-window]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    rate = np.log(m[:, window:] / before)
+    # Cases cannot double from nothing.
+    result[:, window:] = np.where((rate > 0) & (before > 0), window * np.log(2) / rate, np.nan)
+  return result
+
+def case_fatality(confirmed, deaths):
+  """
+  Get the share of confirmed cases that died.
+
+  params:
+  confirmed(np.ndarray): regions x days cumulative cases.
+  deaths(np.ndarray): regions x days cumulative deaths.
+
+  return(np.ndarray): regions x days float matrix, NaN where there are no cases.
+  """
+  c = np.asarray(confirmed, dtype=float)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.where(c > 0, np.asarray(deaths, dtype=float) / c, np.nan)
+
+def per_capita(matrix, population, per = PER_CAPITA):
+  """
+  Get counts per number of inhabitants.
+
+  params:
+  matrix(np.ndarray): regions x days counts.
+  population(np.ndarray): population per region, 0 where it is unknown.
+  per(int): inhabitants to scale to.
+
+  return(np.ndarray): regions x days float matrix, NaN where the population is unknown.
+  """
+  p = np.asarray(population, dtype=float)[:, None]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return np.where(p > 0, np.asarray(matrix, dtype=float) * per / p, np.nan)
+
+def derive(series, population, window = WINDOW):
+  """
+  Compute the derived metrics of every region at once.
+
+  params:
+  series(dict): regions x days cumulative matrices keyed by metric, see dataset.load.
+  population(np.ndarray): population per region, 0 where it is unknown.
+  window(int): days for the rolling average and doubling time.
+
+  return(dict): regions x days matrices keyed by metric, growth has two days less.
+  """
+  confirmed = series['confirmed']
+  new = daily_new(confirmed)
+  derived = {
+    'growth': growth_factor(confirmed),
+    'daily_new': new,
+    'daily_avg': rolling_mean(new, window),
+    'doubling_time': doubling_time(confirmed, window),
+    'per_capita': per_capita(confirmed, population),
+  }
+  if 'deaths' in series:
+    derived['cfr'] = case_fatality(confirmed, series['deaths'])
+  return derived
+
+def attach(points, regions, derived):
+  """
+  Set the derived metrics of every point to its row of the matrices.
+
+  params:
+  points(dict): points keyed by region name.
+  regions(list): region name of every row.
+  derived(dict): matrices from derive.
+  """
+  for i, region in enumerate(regions):
+    if region in points:
+      points[region].update({k: m[i] for k, m in derived.items()})
+
+def latest(values, digits = 4):
+  """
+  Get the last value of a derived series.
+
+  return(float): rounded value, None if the series is empty or the value is undefined.
+  """
+  if not len(values) or not np.isfinite(values[-1]):
+    return None
+  return round(float(values[-1]), digits)
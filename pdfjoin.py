@@ -0,0 +1,111 @@
+import re
+import fileutil
+
+HEADER = b'%PDF-1.4\n%\xac\xdc \xab\xba\n'
+CATALOG = 1
+PAGES = 2
+REFERENCE = re.compile(rb'(\d+) 0 R\b')
+STREAM = re.compile(rb'>>\s*stream\r?\n')
+LENGTH = re.compile(rb'/Length\s+(\d+) 0 R')
+
+def read_objects(data):
+  """
+  Split a PDF with a plain cross-reference table, like the ones matplotlib writes, into
+  its objects.
+
+  params:
+  data(bytes): PDF file contents.
+
+  return(tuple): ({object number: (dictionary, stream)}, trailer), the dictionary part is
+  the object up to the stream keyword, stream is the raw stream including its keywords or
+  b'' for objects without one.
+  """
+  start = int(data[data.rindex(b'startxref') + 9:].split()[0])
+  lines = data[start:].split(b'\n')
+  if lines[0].strip() != b'xref':
+    raise ValueError('PDF without a plain cross-reference table')
+  offsets = {}
+  i = 1
+  while not lines[i].startswith(b'trailer'):
+    first, count = map(int, lines[i].split())
+    for n in range(count):
+      entry = lines[i + 1 + n].split()
+      if entry[2] == b'n':
+        offsets[first + n] = int(entry[0])
+    i += count + 1
+  trailer = data[data.index(b'trailer', start):data.rindex(b'startxref')]
+  # Every object ends where the next one starts, streams may contain any bytes.
+  ends = sorted(offsets.values()) + [start]
+  objects = {}
+  for num, offset in offsets.items():
+    end = ends[ends.index(offset) + 1]
+    body = data[data.index(b'obj', offset) + 3:data.rindex(b'endobj', offset, end)]
+    stream = STREAM.search(body)
+    if stream:
+      split = stream.start() + 2
+      objects[num] = (body[:split], body[split:])
+    else:
+      objects[num] = (body, b'')
+  return objects, trailer
+
+def reference(text, key):
+  """
+  Get the object number a key of a dictionary refers to.
+  """
+  return int(re.search(rb'/' + key + rb'\s+(\d+) 0 R', text).group(1))
+
+def join(pages, outfile):
+  """
+  Join single page PDFs into one document, keeping their order.
+
+  params:
+  pages(iterable): PDF contents (bytes) with one page each.
+  outfile(str): PDF path, replaced once all pages are joined.
+  """
+  out = []
+  kids = []
+  # Glyphs drawn on several pages are embedded by each of them, they are written once.
+  shared = {}
+  free = PAGES + 1
+  for data in pages:
+    objects, trailer = read_objects(data)
+    catalog = reference(trailer, b'Root')
+    tree = reference(objects[catalog][0], b'Pages')
+    drop = {catalog, tree}
+    if re.search(rb'/Info\s', trailer):
+      drop.add(reference(trailer, b'Info'))
+    numbers = {tree: PAGES}
+    kept = []
+    for num in sorted(set(objects) - drop):
+      text, stream = objects[num]
+      length = LENGTH.search(text)
+      if stream and length:
+        text = text.replace(length.group(0), b'/Length ' + objects[int(length.group(1))][0].strip())
+      if stream and not REFERENCE.search(text):
+        if (text, stream) in shared:
+          numbers[num] = shared[(text, stream)]
+          continue
+        shared[(text, stream)] = free
+      numbers[num] = free
+      free += 1
+      kept.append((num, text, stream))
+    renumber = lambda m: b'%d 0 R' % numbers[int(m.group(1))]
+    for num, text, stream in kept:
+      text = REFERENCE.sub(renumber, text)
+      if re.search(rb'/Type\s*/Page\b', text):
+        kids.append(numbers[num])
+      out.append((numbers[num], text, stream))
+  out.append((CATALOG, b'\n<< /Type /Catalog /Pages %d 0 R >>\n' % PAGES, b''))
+  out.append((PAGES, b'\n<< /Type /Pages /Kids [ %s ] /Count %d >>\n'
+              % (b' '.join(b'%d 0 R' % k for k in kids), len(kids)), b''))
+  with fileutil.atomic_open(outfile, 'wb') as f:
+    f.write(HEADER)
+    offsets = {}
+    for num, text, stream in out:
+      offsets[num] = f.tell()
+      f.write(b'%d 0 obj' % num + text + stream + b'endobj\n')
+    start = f.tell()
+    f.write(b'xref\n0 %d\n0000000000 65535 f \n' % free)
+    for num in range(1, free):
+      f.write(b'%010d 00000 n \n' % offsets[num])
+    f.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (free, CATALOG, start))
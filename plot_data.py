@@ -2,26 +2,32 @@
 
 import json
 import argparse
+import functools
+import multiprocessing
 import sys
+import weakref
 from datetime import datetime, timedelta
+from io import BytesIO
 from scipy import stats
 import os
 from urllib import request
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as colors
-from mpl_toolkits.basemap import Basemap
 import numpy as np
 from scipy.optimize import curve_fit
-from matplotlib.backends.backend_pdf import PdfPages
+import fitting
+import dataset
+import metrics
+import pdfjoin
 
 INCUBATION=14
 VERBOSE=False
 THRESH = 300
 GRID = 2
-PROJECT = ['US','China','France','Italy','Korea', 'Iran', 'Australia', 'Switzerland', 'Japan']
+PROJECT = ['US','China','France','Italy','Korea, South', 'Iran', 'Australia', 'Switzerland', 'Japan']
 TYPES = ['Confirmed','Recovered','Deaths']
-OUTPUT = '/home/max/covid-19/resources'
+OUTPUT = dataset.RESOURCES
 ignore = ['Province/State','Country/Region','Lat','Long']
 
 def draw_map(name, coords, dataset):
@@ -31,6 +37,8 @@ def draw_map(name, coords, dataset):
   rlat=coords['ur_lat']
   clat = (llat+rlat) / 2
   clon = (llon+rlon) / 2
+  # Basemap is only needed for maps, the report works without it.
+  from mpl_toolkits.basemap import Basemap
   m = Basemap(llcrnrlon=llon,llcrnrlat=llat,urcrnrlon=rlon,urcrnrlat=rlat, epsg=2163)
 
   m.arcgisimage(service='NatGeo_World_Map', xpixels = 2000, verbose= True)
@@ -50,20 +58,71 @@ def logistic_growth(x, maximum, rate, center, offset):
   return maximum / (1 + np.exp(-rate*(x-center))) + offset;
 
 def parse_dataset(type):
-  path = os.path.join(OUTPUT, type+'.csv')
-  data = pd.read_csv(path)
-  return data
+  return dataset.legacy_frame(type, OUTPUT)
 
 def get_date(past = 1):
   yesterday = datetime.today() - timedelta(days=past)
   date = yesterday.strftime('%m-%d-%Y')
   return date
 
-def filter_data(dataset, column, filter):
-  return dataset[dataset[column].str.contains(filter, na=False)]
-
-def get_data_for_region(dataset, region):
-  return filter_data(dataset, 'Province/State', region)
+class RegionIndex:
+  """
+  Row positions of every country and province of a dataset, built once per frame.
+  """
+  def __init__(self, dataset):
+    self.rows = {}
+    for column in ['Country/Region', 'Province/State']:
+      groups = dataset.groupby(column, sort=False).indices
+      self.rows[column] = {k: np.sort(v) for k, v in groups.items()}
+
+  def lookup(self, column, name):
+    """
+    Get the rows whose column equals name.
+
+    return(np.ndarray): row positions.
+    """
+    return self.rows[column].get(name, np.array([], dtype=np.intp))
+
+  def search(self, column, pattern):
+    """
+    Get the rows whose column contains pattern. Only the distinct names are scanned.
+
+    return(np.ndarray): row positions.
+    """
+    matches = [v for k, v in self.rows[column].items() if pattern in k]
+    if not matches:
+      return np.array([], dtype=np.intp)
+    return np.sort(np.concatenate(matches))
+
+
+_indexes = {}
+
+def region_index(dataset):
+  """
+  Get the RegionIndex of a dataset, building it on first use.
+
+  params:
+  dataset(pd.DataFrame): dataset in the CSSE series layout.
+
+  return(RegionIndex): index.
+  """
+  key = id(dataset)
+  if key in _indexes:
+    ref, index = _indexes[key]
+    if ref() is dataset:
+      return index
+  index = RegionIndex(dataset)
+  # Forget the index once the frame is collected, its id may be reused.
+  _indexes[key] = (weakref.ref(dataset, lambda _: _indexes.pop(key, None)), index)
+  return index
+
+def filter_data(dataset, column, filter, exact = True):
+  index = region_index(dataset)
+  rows = index.lookup(column, filter) if exact else index.search(column, filter)
+  return dataset.iloc[rows]
+
+def get_data_for_region(dataset, region, exact = True):
+  return filter_data(dataset, 'Province/State', region, exact)
 
 def get_data_for_country(dataset, region):
   data = filter_data(dataset, 'Country/Region', region)
@@ -76,10 +135,11 @@ def join_region(region):
   return region.drop(columns=ignore).sum()
 
 def drop_countries(dataset,drop):
-  s = dataset
+  index = region_index(dataset)
+  keep = np.ones(len(dataset), dtype=bool)
   for d in drop:
-    s = s[~s['Country/Region'].str.contains(d, na=False)]
-  return s
+    keep[index.lookup('Country/Region', d)] = False
+  return dataset[keep]
 
 def plot_region(dataset, region):
   region = join_region(get_data_for_region(dataset, region)).values.transpose()
@@ -88,19 +148,20 @@ def plot_region(dataset, region):
   plt.show()
 
 def fit_line(data):
-  log_data = np.log(data)
-  s, y, r, p, err = stats.linregress(range(len(log_data)), log_data)
-  return {'slope':s, 'intercept':y, 'r_value':r, 'p_value':p, 'std_error':err}
+  fit = fitting.loglinear_fit(data)
+  s = fit['slope'][0]
+  err = fit['std_error'][0]
+  p = 2 * stats.t.sf(np.abs(s / err), fit['n'][0] - 2)
+  return {'slope':s, 'intercept':fit['intercept'][0], 'r_value':fit['r_value'][0], 'p_value':p, 'std_error':err}
 
 def plot_data(ax, data, name):
   fit = fit_line(data)
   growth = 1 + fit['slope']
   r = fit['r_value']
   r2 = r * r
-  x = range(len(data))
+  x = np.arange(len(data))
   ax.plot(x,data)
-  m,c = np.polyfit(x, np.log(data), 1)
-  y_fit = np.exp(m*x + c)
+  y_fit = np.exp(fit['slope']*x + fit['intercept'])
   ax.plot(x,y_fit,'k:')
   title = '{0}-({1:.2f}) - $R^2$({2:.2f})'.format(name, growth, r2)
   ax.set_title(title, fontsize=8)
@@ -112,11 +173,7 @@ def plot_growth_rate(dataset, name):
   fig = plt.figure()
   fig.suptitle(r'Growth factor $[\frac{\Delta{N}_{d}}{\Delta{N}_{d-1}}]$ for - %s'%(name))
   ax = fig.add_subplot()
-  data = np.array(join_region(dataset).values.transpose())
-  diffs = data[1:] - data[:-1]
-  growth = diffs[1:]/diffs[:-1]
-  growth[np.isinf(growth)] = 0
-  growth[np.isnan(growth)] = 0
+  growth = metrics.growth_factor(np.atleast_2d(join_region(dataset).values))[0]
   inc = growth[-INCUBATION:]
   inc_x = range(len(growth)-INCUBATION,len(growth),1)
   m,c = np.polyfit(inc_x, inc, 1)
@@ -154,7 +211,7 @@ def plot_countries(dataset, countries, thresh, minimum = 10):
 
 def plot_single(region, name):
   y = join_region(region).values.transpose()
-  x = range(len(y))
+  x = np.arange(len(y))
   plt.figure()
   plt.plot(x,y)
   plt.yscale('log')
@@ -162,8 +219,7 @@ def plot_single(region, name):
   growth = 1 + fit['slope']
   r = fit['r_value']
   r2 = r * r
-  m,c = np.polyfit(x, np.log(y), 1)
-  y_fit = np.exp(m*x + c)
+  y_fit = np.exp(fit['slope']*x + fit['intercept'])
   plt.plot(x,y_fit,'k:')
   title = '{0}-({1:.2f}) - $R^2$({2:.2f})'.format(name, growth, r2)
   plt.title(title)
@@ -205,9 +261,10 @@ def plot_projection(region, name):
 def state_totals(confirmed, recovered, deaths, states):
   data = []
   for state in states:
-    c = get_number_of_cases(confirmed, state)
-    r = get_number_of_cases(recovered, state)
-    d = get_number_of_cases(deaths, state)
+    # States are matched by the abbreviation in county names, e.g. 'King County, WA'.
+    c = get_number_of_cases(confirmed, state, False)
+    r = get_number_of_cases(recovered, state, False)
+    d = get_number_of_cases(deaths, state, False)
     d_rt = "%.2f%%"%(float(d) / c * 100);
     data.append([state, c, r, d, d_rt])
   fig = plt.figure()
@@ -223,21 +280,19 @@ def get_data():
     data[t] = parse_dataset(t)
   return data;
 
-def get_number_of_cases(dataset, region):
-  region = get_data_for_region(dataset, region)
+def get_number_of_cases(dataset, region, exact = True):
+  region = get_data_for_region(dataset, region, exact)
   if(VERBOSE):
     print(region)
   return region.iloc[:,-1].sum()
 
 def get_countries(dataset, thresh = 100, top = 12):
-  countries = dataset['Country/Region'].unique()
+  last = dataset.iloc[:,-1].to_numpy()
   count = {}
-  for c in countries:
+  for c, rows in region_index(dataset).rows['Country/Region'].items():
     if c == 'Others':
       continue
-    data = dataset[dataset['Country/Region'] == c]
-    last = data.iloc[:,-1]
-    total = last.sum()
+    total = np.nansum(last[rows])
     if total > thresh:
       count[c] = total
   return count
@@ -246,6 +301,84 @@ def divide_chunks(l, n):
   for i in range(0, len(l), n):
     yield l[i:i+n]
 
+def render_page(task, png = False):
+  """
+  Draw one report page and save it, so the process that draws it also does the rendering.
+
+  params:
+  task(tuple): (plot function, arguments), the function draws on the current figure and
+  may return False to drop the page.
+  png(bool): also rasterize the page.
+
+  return(tuple): (single page PDF, PNG or None) contents, None if the page was dropped.
+  """
+  fn, args = task
+  try:
+    if fn(*args) is False:
+      return None
+    fig = plt.gcf()
+    pdf = BytesIO()
+    fig.savefig(pdf, format='pdf')
+    if not png:
+      return pdf.getvalue(), None
+    image = BytesIO()
+    fig.savefig(image, format='png')
+    return pdf.getvalue(), image.getvalue()
+  finally:
+    plt.close('all')
+
+def report_pages(confirmed, recovered, deaths, countries):
+  """
+  List the pages of the daily report in order.
+
+  return(list): (plot function, arguments) tasks for render_page.
+  """
+  pages = [(state_totals, (confirmed, recovered, deaths, ['CA','CO','GA','WA']))]
+  for c in divide_chunks(list(countries.keys()), GRID * GRID):
+    # Only send the rows the page plots to the worker.
+    subset = pd.concat([get_data_for_country(confirmed, name) for name in c])
+    pages.append((plot_countries, (subset, c, THRESH, 50)))
+  world = pd.concat([get_data_for_country(confirmed, c) for c in countries if "China" not in c])
+  pages.append((plot_single, (world, "World outside of China")))
+  for p in PROJECT:
+    country = get_data_for_country(confirmed, p)
+    pages.append((plot_growth_rate, (country, p)))
+    pages.append((plot_projection, (country, p)))
+  pages.append((plot_projection, (drop_countries(confirmed, ['China']), 'World (excluding China)')))
+  return pages
+
+def render_report(pages, outfile, jobs = 1, png_dir = None):
+  """
+  Render report pages in a process pool and join them to a PDF in order.
+
+  params:
+  pages(list): tasks from report_pages.
+  outfile(str): PDF path.
+  jobs(int): number of processes.
+  png_dir(str): optional directory to also save every page as a PNG.
+  """
+  if png_dir:
+    os.makedirs(png_dir, exist_ok=True)
+  render = functools.partial(render_page, png=bool(png_dir))
+  pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+  try:
+    rendered = pool.imap(render, pages) if pool else map(render, pages)
+    pdfs = []
+    for page in rendered:
+      if page is None:
+        continue
+      pdf, png = page
+      if png_dir:
+        with open(os.path.join(png_dir, 'page-{:02d}.png'.format(len(pdfs))), 'wb') as f:
+          f.write(png)
+      pdfs.append(pdf)
+  finally:
+    if pool:
+      pool.close()
+      pool.join()
+  pdfjoin.join(pdfs, outfile)
+  print(outfile)
+
 def main(argv = sys.argv[1:]):
   parser = argparse.ArgumentParser()
   parser.add_argument('--verbose',default=False,type=bool)
@@ -253,6 +386,8 @@ def main(argv = sys.argv[1:]):
   parser.add_argument('--thresh',default=300,type=int)
   parser.add_argument('--output',default=None,type=str)
   parser.add_argument('--savepath',default='/tmp',type=str)
+  parser.add_argument('--jobs',default=os.cpu_count(),type=int,help="number of processes rendering pages")
+  parser.add_argument('--png',action='store_true',help="also save every page as a PNG next to the PDF")
   args = parser.parse_args(argv)
   THRESH = args.thresh
   VERBOSE = args.verbose
@@ -263,34 +398,12 @@ def main(argv = sys.argv[1:]):
   recovered = data['Recovered']
 
   countries = get_countries(confirmed, THRESH)
-  world = pd.concat([get_data_for_country(confirmed, c) for c in countries if "China" not in c])
   outfile = os.path.join(args.savepath, '{}.pdf'.format(get_date()))
   if args.output:
     outfile = os.path.join(args.savepath, '{}.pdf'.format(args.output))
-  with PdfPages(outfile) as pdf:
-    state_totals(confirmed, recovered, deaths, ['CA','CO','GA','WA'])
-    pdf.savefig()
-    plt.close()
-    countries_list = list(countries.keys())
-    split_countries = list(divide_chunks(countries_list, GRID * GRID))
-    for c in split_countries:
-      if plot_countries(confirmed, c, THRESH, 50):
-        pdf.savefig()
-        plt.close()
-    plot_single(world, "World outside of China")
-    pdf.savefig()
-    plt.close()
-    for p in PROJECT:
-      country = get_data_for_country(confirmed, p)
-      plot_growth_rate(country, p)
-      pdf.savefig()
-      plt.close()
-      plot_projection(country,p)
-      pdf.savefig()
-      plt.close()
-    plot_projection(drop_countries(confirmed, ['China']), 'World (excluding China)')
-    pdf.savefig()
-    plt.close()
+  png_dir = os.path.splitext(outfile)[0] if args.png else None
+  pages = report_pages(confirmed, recovered, deaths, countries)
+  render_report(pages, outfile, args.jobs, png_dir)
 
 if __name__ == '__main__':
   np.seterr(divide='ignore', invalid='ignore')
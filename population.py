@@ -1,24 +1,27 @@
 import requests
 import re
-from bs4 import BeautifulSoup
 from io import BytesIO, StringIO
 from zipfile import ZipFile
-import pandas as pd
 
-def get_state_population():
-  URL = "https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/state/detail/SCPRC-EST2019-18+POP-RES.csv"
-  d = requests.get(URL)
-  df = pd.read_csv(StringIO(d.text))
+STATE_URL = "https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/state/detail/SCPRC-EST2019-18+POP-RES.csv"
+WORLD_URL = "https://en.wikipedia.org/wiki/List_of_countries_by_population_(United_Nations)"
+
+def parse_state_population(text):
+  import pandas as pd
+  df = pd.read_csv(StringIO(text))
   data = {}
   for i, r in df.iterrows():
     num = int(r['POPESTIMATE2019'])
     data[r['NAME']] = f'{num:,}'
   return data
 
-def get_world_population():
-  URL = "https://en.wikipedia.org/wiki/List_of_countries_by_population_(United_Nations)"
-  r = requests.get(URL)
-  html = BeautifulSoup(r.text, features='html.parser')
+def get_state_population():
+  d = requests.get(STATE_URL)
+  return parse_state_population(d.text)
+
+def parse_world_population(text):
+  from bs4 import BeautifulSoup
+  html = BeautifulSoup(text, features='html.parser')
   table_div = html.findAll('table',{'class':'wikitable'})[1]
   rows = table_div.findAll('tr')
   data = {}
@@ -33,9 +36,17 @@ def get_world_population():
       pass
   return data
 
-def get_populations():
-  d = {**get_world_population(), **get_state_population()}
+def get_world_population():
+  r = requests.get(WORLD_URL)
+  return parse_world_population(r.text)
+
+def merge_populations(world, states):
+  d = {**world, **states}
   d['US'] = d.pop('United States')
   return d
 
-get_populations()
+def get_populations():
+  return merge_populations(get_world_population(), get_state_population())
+
+if __name__ == '__main__':
+  print(get_populations())
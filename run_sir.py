@@ -3,35 +3,133 @@
 import json
 import os
 import argparse
+import multiprocessing
 import sys
 import subprocess as sp
-import matplotlib.pyplot as plt
 import numpy as np
 from datetime import datetime, timedelta
+import dataset
+import fileutil
+import sir
+import simulate
+
+SIR_MODEL = './sir_model'
+RESULTS = os.path.join('resources','SIR.json')
+REFERENCE = os.path.join('resources','sir_reference.json')
 
 def get_peak_date(days):
   d = datetime.strptime('01-22-2020','%m-%d-%Y')
   end = d + timedelta(days=int(days))
   return end.strftime('%m-%d-%Y')
 
-def fill_populations(l):
-  path = os.path.join('resources', 'populations.json')
-  with open(path, 'r') as f:
-    j = json.loads(f.read())
-  for k,v in l.items():
+def load_data():
+  return dataset.points('Countries')
+
+def bundled_countries():
+  """
+  Sum the bundled legacy JHU time series in resources/ per country.
+
+  return(dict): points with confirmed, deaths and recovered keyed by country.
+  """
+  import pandas as pd
+  import update_dataset
+  here = os.path.dirname(os.path.abspath(__file__))
+  points = {}
+  for t in ['Confirmed', 'Deaths', 'Recovered']:
+    df = pd.read_csv(os.path.join(here, 'resources', t + '.csv'))
+    summed = df.drop(columns=update_dataset.ignore).fillna(0).groupby(df['Country/Region']).sum()
+    for name, row in summed.iterrows():
+      points.setdefault(name, {})[t.lower()] = row.to_numpy(dtype=np.int64)
+  return points
+
+def record_reference(path = REFERENCE):
+  """
+  Fit every bundled country with ./sir_model and save the results, test_sir.py compares
+  the in process fits with them.
+
+  params:
+  path(str): reference file.
+  """
+  points = bundled_countries()
+  results = {}
+  for k, p in points.items():
     try:
-      p = int(j[k].replace(',',''))
-      v['population'] = p
-    except:
-      v['population'] = 'N/A'
+      results[k] = run_sir_binary(p, 0, 1e9)
+    except sp.CalledProcessError as e:
+      # A partial reference would make test_sir.py pass on the countries it has.
+      sys.exit('sir_model failed on {} with exit status {}, nothing recorded'.format(k, e.returncode))
+  with fileutil.atomic_open(path, 'w') as f:
+    json.dump(results, f, indent=1, sort_keys=True)
+  print('Recorded {} sir_model fits: {}'.format(len(results), path))
 
-def load_data():
-  path = os.path.join('resources','Countries.json')
-  with open(path, 'r') as f:
-    data = json.load(f)
-  return data
+def load_all_data():
+  return {**dataset.points('Countries'), **dataset.points('States')}
+
+def fit_region(task):
+  """
+  Fit SIR parameters to one region, recording failures instead of raising.
+
+  params:
+  task(tuple): (name, confirmed, deaths, recovered, population guess, trim)
+
+  return(tuple): (name, dict of SIR parameters with status and iterations of the nonlinear
+  solve, status is 'ok' only for converged fits with a positive infection rate)
+  """
+  name, c, d, r, pop, trim = task
+  try:
+    params, result = sir.estimate_sir(c, d, r, pop, trim)
+    if not result.success:
+      params['status'] = result.message
+    elif result.active_mask[1] != 0:
+      # ki ended on its bound, the cost only falls further as s0 grows and ki shrinks
+      # towards zero, so neither can be estimated.
+      params['status'] = 'no infection rate'
+    else:
+      params['status'] = 'ok'
+    # least_squares evaluates the Jacobian once per trust region iteration.
+    params['iterations'] = int(result.njev)
+  except (ValueError, np.linalg.LinAlgError) as e:
+    params = {'status': str(e), 'iterations': 0}
+  return name, params
+
+def run_all(data, trim = 0, jobs = 1):
+  """
+  Fit SIR parameters to every region across a process pool.
 
-def run_sir(data, trim, pop, extra = []):
+  params:
+  data(dict): points keyed by region name.
+  trim(int): days to drop from the front of every series.
+  jobs(int): number of worker processes.
+
+  return(dict): SIR parameters, status and iteration count keyed by region name.
+  """
+  tasks = []
+  for k, v in data.items():
+    c = np.asarray(v['confirmed'])
+    d = np.asarray(v['deaths'])
+    # States have no recovered series.
+    r = np.asarray(v['recovered']) if len(v['recovered']) else np.zeros_like(c)
+    pop = v['population'] if v['population'] != 'N/A' else 1e9
+    tasks.append((k, c, d, r, pop, trim))
+  if jobs > 1:
+    with multiprocessing.Pool(jobs) as pool:
+      return dict(pool.imap(fit_region, tasks, chunksize=8))
+  return dict(map(fit_region, tasks))
+
+def run_sir(data, trim, pop):
+  """
+  Fit SIR parameters to a point in process.
+
+  params:
+  data(dict): point with confirmed, deaths and recovered series.
+  trim(int): days to drop from the front.
+  pop(int): initial guess of the susceptible population.
+
+  return(dict): population, ki, kr, i0 and r0.
+  """
+  return sir.fit_sir(data['confirmed'], data['deaths'], data['recovered'], pop, trim)
+
+def run_sir_binary(data, trim, pop, extra = []):
   c = [str(i) for i in data['confirmed']]
   d = [str(i) for i in data['deaths']]
   r = [str(i) for i in data['recovered']]
@@ -42,43 +140,34 @@ def run_sir(data, trim, pop, extra = []):
     ] + extra
   cmd_fmt = '{bin} --confirmed {c} --deaths {d} --recovered {r} --population {p} --trim {t} {flags}'
   cmd = cmd_fmt.format(
-      bin='./sir_model',
+      bin=SIR_MODEL,
       c=','.join(c),
       d=','.join(d),
       r=','.join(r),
-      p=pop,
+      p=int(pop),
       t=trim,
       flags = ' '.join(flags))
   out = sp.check_output(cmd.split())
-  return out
+  return json.loads(out)
+
+def compare_sir(a, b, rtol = 1e-3):
+  """
+  Compare two SIR fits. sir_model prints 6 significant digits.
+
+  return(list): names of the parameters that differ.
+  """
+  return [k for k in ['population', 'ki', 'kr', 'i0', 'r0'] if not np.isclose(a[k], b[k], rtol=rtol)]
 
 def plot_sir(s, ki, kr, i0 = 1, r0 = 0, days = None):
   i0 = max(i0,1)
   if days is None:
-    t = 365
-  else:
-    t = days
-  i = i0
-  r = r0
-  sp = 0
-  si = 0
-  sr = 0
-  sus = []
-  inf = []
-  rem = []
-  for _ in range(t):
-    sus.append(s)
-    inf.append(i)
-    rem.append(r)
-    sp = -ki * i * s
-    ip = ki * i * s - kr * i
-    rp = kr * i
-    s += sp
-    i += ip
-    r += rp
-  print('peak: {}'.format(get_peak_date(np.argmax(inf))))
-  plt.plot(inf)
-  plt.plot(rem)
+    days = 365
+  sus, inf, rem = simulate.simulate(s, ki, kr, i0, r0, days)
+  day, _ = simulate.peaks(inf)
+  print('peak: {}'.format(get_peak_date(day[0])))
+  import matplotlib.pyplot as plt
+  plt.plot(inf[0])
+  plt.plot(rem[0])
 
 def plot_curr(data):
   c = np.array(data['confirmed'])
@@ -86,28 +175,59 @@ def plot_curr(data):
   r = np.array(data['recovered'])
   rem = d + r;
   inf = c - rem;
+  import matplotlib.pyplot as plt
   plt.figure(1)
   plt.plot(rem)
   plt.plot(inf)
 
 def main(argv=sys.argv[1:]):
   parser = argparse.ArgumentParser()
-  parser.add_argument('--region',required=True)
+  parser.add_argument('--region')
+  parser.add_argument('--all',action='store_true',help="fit every country and state and save the results")
+  parser.add_argument('--jobs',type=int,default=os.cpu_count(),help="number of processes for --all")
+  parser.add_argument('--output',type=str,default=RESULTS,help="results file for --all")
   parser.add_argument('--trim',type=int, default=0)
   parser.add_argument('--flags',type=str, default="")
   parser.add_argument('--clip_days',type=bool, default=False)
+  parser.add_argument('--binary',action='store_true',help="fit with ./sir_model instead of in process")
+  parser.add_argument('--check',action='store_true',help="compare the in process fit with ./sir_model")
+  parser.add_argument('--record-reference',dest='record_reference',action='store_true',help="save ./sir_model fits of the bundled countries for test_sir.py")
   args = parser.parse_args(argv)
+  if args.record_reference:
+    record_reference()
+    return
+  if args.all:
+    data = load_all_data()
+    results = run_all(data, args.trim, args.jobs)
+    with open(args.output, 'w') as f:
+      json.dump(results, f)
+    ok = sum(1 for v in results.values() if v['status'] == 'ok')
+    print('Fitted {} of {} regions: {}'.format(ok, len(results), args.output))
+    return
+  if args.region is None:
+    parser.error('--region is required unless --all is given')
   data = load_data()
-  fill_populations(data)
   r = data[args.region]
   conf = r['confirmed'][-1]
   if args.clip_days:
     days = len(r['confirmed'])
   else:
     days = None
-  sir = run_sir(r, args.trim, r['population'], args.flags.split(','))
-  out = json.loads(sir)
+  pop = r['population'] if r['population'] != 'N/A' else 1e9
+  if args.binary:
+    out = run_sir_binary(r, args.trim, pop, args.flags.split(','))
+  else:
+    out = run_sir(r, args.trim, pop)
   print(out)
+  if args.check:
+    ref = run_sir_binary(r, args.trim, pop, args.flags.split(','))
+    print('sir_model: {}'.format(ref))
+    diff = compare_sir(out, ref)
+    if diff:
+      print('Mismatch: {}'.format(', '.join(diff)))
+      sys.exit(1)
+  # Plotting is the only use of matplotlib, --all and --check exit before it.
+  import matplotlib.pyplot as plt
   plt.figure(0)
   plot_sir(out['population'],out['ki'],out['kr'],out['i0'],out['r0'], days)
   plot_curr(r)
@@ -0,0 +1,85 @@
+from collections import namedtuple
+import numpy as np
+
+Trajectories = namedtuple('Trajectories', ['susceptible', 'infected', 'removed'])
+Sweep = namedtuple('Sweep', ['ki', 'kr', 'i0', 'trajectories', 'peak_day', 'peak_height'])
+
+def allocate(scenarios, days):
+  """
+  Allocate the buffers for simulate.
+
+  return(Trajectories): scenarios x days float matrices.
+  """
+  return Trajectories(*[np.empty((scenarios, days)) for _ in range(3)])
+
+def simulate(s0, ki, kr, i0 = 1, r0 = 0, days = 365, out = None):
+  """
+  Step the SIR difference equations of plot_sir for many scenarios at once.
+  Parameters are broadcast against each other, one scenario per element.
+
+  params:
+  s0(array_like): initial susceptible population.
+  ki(array_like): infection rate.
+  kr(array_like): removal rate.
+  i0(array_like): initial infected.
+  r0(array_like): initial removed.
+  days(int): number of days to simulate, including day 0.
+  out(Trajectories): preallocated buffers to reuse, see allocate.
+
+  return(Trajectories): scenarios x days matrices of susceptible, infected and removed.
+  """
+  s, ki, kr, i, r = [np.array(v, dtype=float).ravel() for v in
+                     np.broadcast_arrays(s0, ki, kr, i0, r0)]
+  if out is None:
+    out = allocate(len(s), days)
+  sus, inf, rem = out
+  if sus.shape != (len(s), days):
+    raise ValueError('Buffers of shape {} for {} scenarios and {} days'.format(sus.shape, len(s), days))
+  new = np.empty_like(s)
+  removals = np.empty_like(s)
+  change = np.empty_like(s)
+  for t in range(days):
+    sus[:, t] = s
+    inf[:, t] = i
+    rem[:, t] = r
+    np.multiply(ki, i, out=new)
+    new *= s
+    np.multiply(kr, i, out=removals)
+    np.subtract(new, removals, out=change)
+    s -= new
+    i += change
+    r += removals
+  return out
+
+def peaks(infected):
+  """
+  Find the day and height of the infection peak of every scenario.
+
+  params:
+  infected(np.ndarray): scenarios x days matrix.
+
+  return(tuple): (peak day, peak height) arrays.
+  """
+  day = np.argmax(infected, axis=1)
+  return day, infected[np.arange(len(day)), day]
+
+def sweep(s0, ki, kr, i0 = 1, r0 = 0, days = 365, out = None):
+  """
+  Simulate every combination of a grid of ki, kr and i0 values.
+
+  params:
+  s0(float): initial susceptible population.
+  ki(array_like): infection rates.
+  kr(array_like): removal rates.
+  i0(array_like): initial infected.
+  r0(float): initial removed.
+  days(int): number of days to simulate.
+  out(Trajectories): preallocated buffers for len(ki) * len(kr) * len(i0) scenarios.
+
+  return(Sweep): flattened grid parameters, trajectories and peaks in grid order.
+  """
+  grid = np.meshgrid(np.atleast_1d(ki), np.atleast_1d(kr), np.atleast_1d(i0), indexing='ij')
+  ki, kr, i0 = [g.ravel() for g in grid]
+  trajectories = simulate(s0, ki, kr, i0, r0, days, out)
+  day, height = peaks(trajectories.infected)
+  return Sweep(ki, kr, i0, trajectories, day, height)
@@ -0,0 +1,122 @@
+import numpy as np
+
+def trim_series(confirmed, deaths, recovered, trim = 0):
+  """
+  Drop the first days of the series the same way sir_model --trim does.
+
+  return(tuple): (confirmed, deaths, recovered) int64 arrays of equal length.
+  """
+  c = np.asarray(confirmed, dtype=np.int64)
+  d = np.asarray(deaths, dtype=np.int64)
+  r = np.asarray(recovered, dtype=np.int64)
+  if not (len(c) == len(d) == len(r)):
+    raise ValueError("Array lengths are not the same")
+  c = c[trim:]
+  return c, d[len(d) - len(c):], r[len(r) - len(c):]
+
+def sir_system(c, d, r):
+  """
+  Build the residuals of SIRCostFunctor in sir_model.cpp as a linear system.
+
+  With s = s0 - i - r the model derivatives are
+    S' = -ki * s * i = -a * i + ki * (i + r) * i
+    I' = ki * s * i - kr * i = a * i - ki * (i + r) * i - kr * i
+    R' = kr * i
+  which are linear in theta = (a, ki, kr) where a = ki * s0.
+
+  return(tuple): (A, b) so that the residuals are A.dot(theta) - b.
+  """
+  dc = np.diff(c).astype(float)
+  dr = (np.diff(r) + np.diff(d)).astype(float)
+  di = dc - dr
+  ds = -dc
+  removed = (d[1:] + r[1:]).astype(float)
+  infected = c[1:] - removed
+  n = len(dc)
+  A = np.zeros((3 * n, 3))
+  b = np.zeros(3 * n)
+  A[0::3, 0] = -infected
+  A[0::3, 1] = (infected + removed) * infected
+  b[0::3] = ds
+  A[1::3, 0] = infected
+  A[1::3, 1] = -(infected + removed) * infected
+  A[1::3, 2] = -infected
+  b[1::3] = di
+  A[2::3, 2] = infected
+  b[2::3] = dr
+  return A, b
+
+def sir_residuals(theta, A, b):
+  """
+  Get the residuals of sir_model.cpp for theta = (s0, ki, kr), see sir_system.
+  """
+  s0, ki, kr = theta
+  return A.dot([ki * s0, ki, kr]) - b
+
+def sir_cost(params, confirmed, deaths, recovered, trim = 0):
+  """
+  Get the cost ceres reports for a fit, half the sum of squared residuals.
+
+  params:
+  params(dict): fit with population, ki and kr, e.g. from fit_sir or sir_model.
+
+  return(float): cost.
+  """
+  A, b = sir_system(*trim_series(confirmed, deaths, recovered, trim))
+  res = sir_residuals([params['population'], params['ki'], params['kr']], A, b)
+  return 0.5 * res.dot(res)
+
+def sir_jacobian(theta, A, b):
+  s0, ki, kr = theta
+  return np.column_stack([A[:, 0] * ki, A[:, 0] * s0 + A[:, 1], A[:, 2]])
+
+def estimate_sir(confirmed, deaths, recovered, population = 1e9, trim = 0):
+  """
+  Estimate SIR parameters in process, minimizing the residuals of sir_model.cpp over
+  (s0, ki, kr) with non-negative bounds like its ceres solve.
+
+  The residuals are linear in (a, ki, kr) with a = ki * s0, so a bounded linear least squares
+  solve gives the starting point. It cannot be mapped back when ki ends on its bound while a
+  does not, so the start is always refined by a nonlinear solve of the original parameters,
+  with s0 set to the population guess if ki is zero.
+
+  params:
+  confirmed(list): confirmed cases by day.
+  deaths(list): deaths by day.
+  recovered(list): recoveries by day.
+  population(float): initial guess of the susceptible population.
+  trim(int): days to drop from the front.
+
+  return(tuple): (dict of population, ki, kr, i0 and r0, scipy OptimizeResult of the
+  nonlinear solve)
+  """
+  from scipy.optimize import least_squares, lsq_linear
+  c, d, r = trim_series(confirmed, deaths, recovered, trim)
+  if len(c) < 2:
+    raise ValueError("Need at least two days of data")
+  A, b = sir_system(c, d, r)
+  # Normalize columns, the terms differ by many orders of magnitude.
+  scale = np.linalg.norm(A, axis=0)
+  scale[scale == 0] = 1
+  a, ki, kr = lsq_linear(A / scale, b, bounds=(0, np.inf), method='bvls').x / scale
+  s0 = a / ki if ki > 0 else float(population)
+  start = [s0, ki if ki > 0 else a / s0, kr]
+  result = least_squares(sir_residuals, start, jac=sir_jacobian, args=(A, b),
+                         bounds=(0, np.inf), x_scale='jac', method='trf')
+  s0, ki, kr = result.x
+  params = {
+    'population': int(s0),
+    'ki': float(ki),
+    'kr': float(kr),
+    'i0': int(c[0] - r[0]),
+    'r0': int(d[0] + r[0]),
+  }
+  return params, result
+
+def fit_sir(confirmed, deaths, recovered, population = 1e9, trim = 0):
+  """
+  Estimate SIR parameters, see estimate_sir.
+
+  return(dict): population, ki, kr, i0 and r0 like the output of sir_model.
+  """
+  return estimate_sir(confirmed, deaths, recovered, population, trim)[0]
@@ -0,0 +1,143 @@
+import json
+import os
+from collections import namedtuple
+import numpy as np
+import fileutil
+
+SUFFIX = '.store'
+INDEX = 'index.json'
+DTYPE = np.dtype('<i4')
+
+Store = namedtuple('Store', ['regions', 'dates', 'series', 'meta', 'rows', 'groups'])
+
+def metric_path(path, metric):
+  return os.path.join(path, metric + '.i32')
+
+def replace_file(path, write):
+  with fileutil.atomic_open(path, 'wb') as f:
+    write(f)
+
+def series_matrix(points, names, metric, days):
+  """
+  Stack one metric of every point into a region x date int32 matrix.
+  Points without the metric get a row of zeros.
+
+  return(np.ndarray): matrix.
+  """
+  matrix = np.zeros((len(names), days), dtype=np.int64)
+  for i, name in enumerate(names):
+    values = points[name].get(metric)
+    if values is not None and len(values):
+      matrix[i] = values
+  if matrix.size and (matrix.max() > np.iinfo(DTYPE).max or matrix.min() < np.iinfo(DTYPE).min):
+    raise ValueError('{} does not fit in {}'.format(metric, DTYPE))
+  return matrix.astype(DTYPE)
+
+def write_store(path, points, metrics, dates = None, groups = None):
+  """
+  Write points as a columnar store: one raw int32 region x date matrix per metric
+  plus an index with the region names, date axis and per-region metadata.
+
+  params:
+  path(str): store directory.
+  points(dict): points keyed by region name.
+  metrics(list): series keys to store as matrices.
+  dates(list): date labels, defaults to day offsets.
+  groups(dict): optional [start, stop) row ranges keyed by group name, for points
+  stored contiguously per group.
+  """
+  os.makedirs(path, exist_ok=True)
+  names = list(points.keys())
+  days = max([len(p.get(m, [])) for p in points.values() for m in metrics] + [0])
+  if dates is None:
+    dates = list(range(days))
+  if len(dates) != days:
+    raise ValueError('{} dates for {} days of data'.format(len(dates), days))
+  keys = []
+  for p in points.values():
+    keys += [k for k in p.keys() if k not in metrics and k not in keys]
+  meta = {k: [points[name].get(k) for name in names] for k in keys}
+  for m in metrics:
+    matrix = series_matrix(points, names, m, days)
+    replace_file(metric_path(path, m), lambda f: f.write(matrix.tobytes()))
+  index = {
+    'regions': names,
+    'dates': list(dates),
+    'metrics': list(metrics),
+    'dtype': DTYPE.str,
+    'meta': meta,
+    'groups': groups or {},
+  }
+  replace_file(os.path.join(path, INDEX), lambda f: f.write(json.dumps(index).encode()))
+  print(path)
+
+def load_store(path):
+  """
+  Open a columnar store. Matrices are memory-mapped read-only, nothing is copied.
+
+  params:
+  path(str): store directory.
+
+  return(Store): regions, dates, matrices keyed by metric, metadata, row index keyed by region
+  and row slices keyed by group.
+  """
+  with open(os.path.join(path, INDEX), 'r') as f:
+    index = json.load(f)
+  shape = (len(index['regions']), len(index['dates']))
+  dtype = np.dtype(index['dtype'])
+  series = {}
+  for m in index['metrics']:
+    if shape[0] * shape[1] == 0:
+      series[m] = np.zeros(shape, dtype=dtype)
+    else:
+      series[m] = np.memmap(metric_path(path, m), dtype=dtype, mode='r', shape=shape)
+  rows = {name: i for i, name in enumerate(index['regions'])}
+  groups = {k: slice(*v) for k, v in index.get('groups', {}).items()}
+  return Store(index['regions'], index['dates'], series, index['meta'], rows, groups)
+
+def to_points(store, rows = slice(None)):
+  """
+  Convert a store back to points keyed by region name. Series are row views of the
+  memory-mapped matrices.
+
+  params:
+  store(Store): open store.
+  rows(slice): rows to convert, e.g. store.groups[name], defaults to all.
+
+  return(dict): points.
+  """
+  points = {}
+  for i in range(len(store.regions))[rows]:
+    name = store.regions[i]
+    point = {k: v[i] for k, v in store.meta.items() if v[i] is not None}
+    for m, matrix in store.series.items():
+      point[m] = matrix[i]
+    points[name] = point
+  return points
+
+def load_points(path):
+  """
+  Load points from a store if there is one, otherwise from the JSON export.
+
+  params:
+  path(str): artifact path without extension, e.g. resources/Countries.
+
+  return(dict): points keyed by region name.
+  """
+  if os.path.exists(os.path.join(path + SUFFIX, INDEX)):
+    return to_points(load_store(path + SUFFIX))
+  with open(path + '.json', 'r') as f:
+    return json.load(f)
+
+def group_total(store, group, metric):
+  """
+  Sum one metric over the contiguous rows of a group, e.g. the counties of a state.
+
+  params:
+  store(Store): open store.
+  group(str): group name.
+  metric(str): metric name.
+
+  return(np.ndarray): int64 series.
+  """
+  return store.series[metric][store.groups[group]].sum(axis=0, dtype=np.int64)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import update_dataset
+
+def us_states(num_states=56, days=730, seed=0):
+  """
+  Generate a frame shaped like the NYT us-states CSV.
+
+  params:
+  num_states(int): number of states.
+  days(int): number of days of history.
+  seed(int): random seed.
+
+  return(tuple): (frame, state coordinates keyed by name)
+  """
+  rng = np.random.default_rng(seed)
+  start = datetime(2020, 1, 21)
+  names = ['State {}'.format(i) for i in range(num_states)]
+  rows = []
+  first = rng.integers(0, days // 4, num_states)
+  for d in range(days):
+    date = (start + timedelta(days=d)).strftime('%Y-%m-%d')
+    for i, name in enumerate(names):
+      if d < first[i]:
+        continue
+      n = d - first[i] + 1
+      rows.append((date, name, i, n * n, n))
+  df = pd.DataFrame(rows, columns=['date','state','fips','cases','deaths'])
+  states = {name: {'lat': 0.0, 'lon': 0.0} for name in names}
+  return df, states
+
+# The first countries get the names plot_data.PROJECT reports on.
+NAMED = ['US', 'China', 'France', 'Italy', 'Korea, South', 'Iran', 'Australia', 'Switzerland', 'Japan']
+
+def country_name(i):
+  return NAMED[i] if i < len(NAMED) else 'Country {}'.format(i)
+
+def global_series(num_countries=190, provinces=3, days=730, seed=0):
+  """
+  Generate frames shaped like the JHU global time-series CSVs.
+
+  params:
+  num_countries(int): number of countries.
+  provinces(int): provinces per country in addition to the country row.
+  days(int): number of days of history.
+  seed(int): random seed.
+
+  return(dict): frames keyed by case type.
+  """
+  rng = np.random.default_rng(seed)
+  start = datetime(2020, 1, 22)
+  dates = []
+  for d in range(days):
+    date = start + timedelta(days=d)
+    dates.append('{}/{}/{:02d}'.format(date.month, date.day, date.year % 100))
+  rows = []
+  for i in range(num_countries):
+    for p in range(provinces + 1):
+      province = 'Province {}'.format(p) if p else np.nan
+      rows.append((province, country_name(i), rng.uniform(-60, 60), rng.uniform(-180, 180)))
+  meta = pd.DataFrame(rows, columns=update_dataset.ignore)
+  first = rng.integers(0, days // 4, len(rows))
+  n = np.clip(np.arange(days)[None, :] - first[:, None], 0, None)
+  frames = {}
+  for c, scale in zip(update_dataset.CASES, [1.0, 0.05, 0.5]):
+    values = pd.DataFrame((n * n * scale).astype(np.int64), columns=dates)
+    frames[c] = pd.concat([meta, values], axis=1)
+  return frames
+
+def us_counties(num_states=56, counties=60, days=730, seed=0):
+  """
+  Generate a frame shaped like the NYT us-counties CSV.
+
+  params:
+  num_states(int): number of states.
+  counties(int): counties per state.
+  days(int): number of days of history.
+  seed(int): random seed.
+
+  return(pd.DataFrame): frame sorted by date.
+  """
+  rng = np.random.default_rng(seed)
+  start = datetime(2020, 1, 21)
+  n = num_states * counties
+  state = np.repeat(['State {}'.format(i) for i in range(num_states)], counties)
+  county = np.array(['County {}'.format(i % counties) for i in range(n)])
+  fips = np.arange(n) + 1000
+  first = rng.integers(0, days // 4, n)
+  frames = []
+  for d in range(days):
+    live = first <= d
+    k = d - first[live] + 1
+    frames.append(pd.DataFrame({
+      'date': (start + timedelta(days=d)).strftime('%Y-%m-%d'),
+      'county': county[live],
+      'state': state[live],
+      'fips': fips[live],
+      'cases': k * k,
+      'deaths': k,
+    }))
+  return pd.concat(frames, ignore_index=True)
+
+def write_raw(directory, regions=190, states=56, counties=60, days=730, provinces=3):
+  """
+  Write synthetic upstream files into a directory under their raw cache filenames.
+
+  params:
+  directory(str): output directory.
+
+  return(dict): file paths keyed by source name.
+  """
+  os.makedirs(directory, exist_ok=True)
+  paths = {s.name: os.path.join(directory, s.filename) for s in update_dataset.SOURCES}
+  for c, df in global_series(regions, provinces, days).items():
+    df.to_csv(paths[c], index=False)
+  state_df, coords = us_states(states, days)
+  state_df.to_csv(paths['states'], index=False)
+  us_counties(states, counties, days).to_csv(paths['counties'], index=False)
+  rows = ''.join('<tr><td>{}</td><td></td><td></td><td>{:,}</td></tr>'.format(country_name(i), 1000000 + i) for i in range(regions))
+  with open(paths['world_population'], 'w') as f:
+    f.write('<table class="wikitable"></table><table class="wikitable">{}</table>'.format(rows))
+  with open(paths['state_population'], 'w') as f:
+    f.write('NAME,POPESTIMATE2019\nUnited States,328239523\n')
+    for name in coords:
+      f.write('{},{}\n'.format(name, 1000000))
+  return paths
+
+
+def write_workspace(directory, regions=190, provinces=3, states=56, counties=60, days=730):
+  """
+  Write a synthetic copy of everything the scripts read: the upstream files to serve
+  as a mirror, resources/state_coords.json and the legacy CSVs plot_data reads.
+
+  params:
+  directory(str): workspace directory, the scripts are run from it.
+
+  return(dict): upstream file paths keyed by source name.
+  """
+  resources = os.path.join(directory, update_dataset.OUTPUT)
+  os.makedirs(resources, exist_ok=True)
+  paths = write_raw(os.path.join(directory, 'upstream'), regions, states, counties, days, provinces)
+  _, coords = us_states(states, days)
+  with open(os.path.join(resources, 'state_coords.json'), 'w') as f:
+    json.dump(coords, f)
+  for c, df in global_series(regions, provinces, days).items():
+    df.to_csv(os.path.join(resources, c.capitalize() + '.csv'), index=False)
+  return paths
+
+def main(argv = sys.argv[1:]):
+  parser = argparse.ArgumentParser(description="Write a synthetic dataset to run the scripts against offline.")
+  parser.add_argument('directory')
+  parser.add_argument('--regions',type=int,default=190)
+  parser.add_argument('--provinces',type=int,default=3)
+  parser.add_argument('--states',type=int,default=56)
+  parser.add_argument('--counties',type=int,default=60,help="counties per state")
+  parser.add_argument('--days',type=int,default=730)
+  args = parser.parse_args(argv)
+  paths = write_workspace(args.directory, args.regions, args.provinces, args.states, args.counties, args.days)
+  for name, path in paths.items():
+    print('{}: {}'.format(name, path))
+
+if __name__ == '__main__':
+  main()
@@ -150,6 +150,7 @@
     <script type="text/javascript" async
       src="https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-MML-AM_CHTML">
     </script>
+    <script src="{{ index_url }}"></script>
     <script>
       var selected_data = null;
       var LOG_SCALE = false;
@@ -157,7 +158,49 @@
       var ENABLE_LOG = false;
       var SLIDER_POS = {{ days - 1 }};
       var PLOT_TYPE = "TRACE";
-      var all_data = {{ points_dict }};
+      var series_requests = {};
+      function undelta(values) {
+        var out = [];
+        var total = 0;
+        for(var i = 0; i < values.length; ++i) {
+          total += values[i];
+          out.push(total);
+        }
+        return out;
+      }
+      // Called by the per-region series scripts in data/series.
+      function seriesLoaded(id, series) {
+        series_requests[id].resolve(series);
+      }
+      // Load the per-day data of a region on first use. Series are script files
+      // so the dashboard also works when opened from disk.
+      function loadSeries(name) {
+        var point = all_data[name];
+        if (series_requests[point.id] !== undefined) {
+          return series_requests[point.id].promise;
+        }
+        var request = {};
+        series_requests[point.id] = request;
+        request.promise = new Promise(function(resolve, reject) {
+          request.resolve = function(series) {
+            point.confirmed = undelta(series.confirmed);
+            point.deaths = undelta(series.deaths);
+            point.recovered = undelta(series.recovered);
+            point.growth_factor = series.growth_factor;
+            point.counties = series.counties;
+            resolve(point);
+          };
+          request.reject = reject;
+        });
+        var script = document.createElement('script');
+        script.src = 'data/series/' + point.id + '.js?v=' + point.v;
+        script.onerror = function() {
+          delete series_requests[point.id];
+          request.reject(new Error('Could not load data for ' + name));
+        };
+        document.head.appendChild(script);
+        return request.promise;
+      }
       function logisticProjection(terms, n) {
         var y = [];
         var max = terms[0];
@@ -187,6 +230,10 @@
         var doub = log_x(1+terms[1], (c*2)/terms[0]) + terms[2];
         return doub - curr;
       }
+      // Format a derived metric from the index, null where it is undefined.
+      function formatMetric(value, digits) {
+        return value === null || value === undefined ? 'N/A' : value.toFixed(digits);
+      }
 
       function openWarningGeneric(msg) {
         var elem = document.getElementById("warningDiv");
@@ -279,19 +326,9 @@
           },
           attributes: {
             name: point['name'],
-            total_confirmed: point['confirmed'][point['confirmed'].length - 1],
-            total_deaths: point['deaths'][point['deaths'].length - 1],
-            total_recovered: point['recovered'][point['recovered'].length - 1],
-            confirmed: point['confirmed'],
-            deaths: point['deaths'],
-            recovered: point['recovered'],
-            lat: point['lat'],
-            lon: point['lon'],
-            exp_terms: point['exp_terms'],
-            log_terms: point['log_terms'],
-            growth_factor: point['growth'],
-            population: point['population'],
-            counties: point['counties'],
+            total_confirmed: point['total_confirmed'],
+            total_deaths: point['total_deaths'],
+            total_recovered: point['total_recovered'],
           },
         }));
       }
@@ -312,7 +349,13 @@
       function getGraphic(r) {
         var graphic = r.results[0].graphic;
         if(graphic.attributes.name !== undefined) {
-          openPopup(r.screenPoint,graphic.attributes);
+          loadSeries(graphic.attributes.name)
+            .then(function(data) {
+              openPopup(r.screenPoint, data);
+            })
+            .catch(function(e) {
+              openWarningGeneric(e.message);
+            });
         } else {
           closeDiv('popupDiv');
         }
@@ -337,7 +380,7 @@
         confirmed.innerHTML = "Confirmed: " + data.total_confirmed;
         deaths.innerHTML = "Deaths: " + data.total_deaths;
         recovered.innerHTML = "Recovered: " + data.total_recovered;
-        population.innerHTML = "Pop: " + data.population;
+        population.innerHTML = "Pop: " + data.population.toLocaleString("en-US");
         updated.innerHTML = "Last updated: " + dates[dates.length - 1];
         selected_data = data;
       }
@@ -470,6 +513,11 @@
       log_td.innerHTML=`L=${l}, r=${r}, xi=${xi}, b=${b}`;
       var d2d = document.getElementById('d2d');
       d2d.innerHTML = daysToDouble(exp_terms, selected_data.confirmed[selected_data.confirmed.length-1]).toFixed(3);
+      d2d.innerHTML += ' / ' + formatMetric(selected_data.doubling_time, 1);
+      document.getElementById('daily_avg').innerHTML = formatMetric(selected_data.daily_avg, 1);
+      var cfr = selected_data.cfr;
+      document.getElementById('cfr').innerHTML = cfr === null || cfr === undefined ? 'N/A' : formatMetric(cfr * 100, 2) + '%';
+      document.getElementById('per_capita').innerHTML = formatMetric(selected_data.per_capita, 1);
     }
     function updatePlot() {
       console.log(selected_data);
@@ -478,7 +526,7 @@
       var margin = (data.length > 3 ? data[3].x.length : data[0].x.length);
       var scale = (LOG_SCALE ? 'log' : 'linear');
       var plot_layout = {
-title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_data.population + ")",
+title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_data.population.toLocaleString("en-US") + ")",
         yaxis: {
           type: scale,
           title: "Cases",
@@ -501,22 +549,31 @@ title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_
     }
     function updateCompare() {
       showControls('compare-control')
-      var data = []
+      var names = []
       {% for i in range(2) %}
         var e = document.getElementById('country-select{{ i }}')
-        var thresh = parseInt(document.getElementById('case_thresh').value)
-        var name = e[e.selectedIndex].text;
-        var country = all_data[name];
+        names.push(e[e.selectedIndex].text);
+      {% endfor %}
+      Promise.all(names.map(loadSeries))
+        .then(plotCompare)
+        .catch(function(e) {
+          openWarningGeneric(e.message);
+        });
+    }
+    function plotCompare(countries) {
+      var data = []
+      var thresh = parseInt(document.getElementById('case_thresh').value)
+      countries.forEach(function(country) {
         var f = firstCase(country.confirmed, thresh);
         var l = country.confirmed.length;
         var y = country.confirmed.slice(f,l);
         var d = {
           y: y,
           mode: 'lines+markers',
-          name: name,
+          name: country.name,
         };
         data.push(d);
-      {% endfor %}
+      });
       var scale = (LOG_SCALE ? 'log' : 'linear');
       var plot_layout = {
         title: "Growth Comparison",
@@ -631,11 +688,14 @@ title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_
       </div>
       <div class="control" id="compare-control">
         <button onclick="toggleLog()">Toggle Log Scale</button>
-        {% for i in range(2) %}
-          <select id="country-select{{ i }}" onchange="update()">
-            {% for k,v in points_dict.items() %}
+        {% set options %}
+            {% for k in regions %}
               <option value="{{ k }}">{{ k }}</option>
             {% endfor %}
+        {% endset %}
+        {% for i in range(2) %}
+          <select id="country-select{{ i }}" onchange="update()">
+            {{ options }}
           </select>
         {% endfor %}
         <span>Starting number of cases:</span>
@@ -650,7 +710,10 @@ title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_
           <th>Growth Factor<span class="equation">$${\frac{\Delta N_d}{\Delta N_{d-1}}}$$</span></th>
           <th>Exponential Growth<span class="equation">$${f(x)=P_0(1+r)^{x-x_0}}$$</span></th>
           <th>Logistic Growth<span class="equation">$${f(x)=\frac{L}{1+e^{-r(x-x_i)}}+b}$$</span></th>
-          <th>Days to Double</th>
+          <th>Days to Double<br>(fit / last 7 days)</th>
+          <th>New Cases<br>(7 day average)</th>
+          <th>Case Fatality Rate</th>
+          <th>Cases per 100k</th>
         </tr>
         <tr>
           <td align="center"><span id="new_cases"></span></td>
@@ -658,6 +721,9 @@ title: "Growth rate for: " + selected_data.name + " - (Population: " + selected_
           <td align="center"><span id="exp_terms"></span></td>
           <td align="center"><span id="log_terms"></span></td>
           <td align="center"><span id="d2d"></span></td>
+          <td align="center"><span id="daily_avg"></span></td>
+          <td align="center"><span id="cfr"></span></td>
+          <td align="center"><span id="per_capita"></span></td>
         </tr>
       </table>
       </center>
@@ -0,0 +1,58 @@
+import json
+import os
+import unittest
+import numpy as np
+import run_sir
+import sir
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REFERENCE = os.path.join(HERE, run_sir.REFERENCE)
+# sir_model starts every solve from these parameters.
+BINARY_START = [1e9, 0.1, 0.1]
+
+def cost(params, point):
+  return sir.sir_cost(params, point['confirmed'], point['deaths'], point['recovered'])
+
+class TestFitSir(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.points = run_sir.bundled_countries()
+    cls.results = {k: sir.estimate_sir(p['confirmed'], p['deaths'], p['recovered'])
+                   for k, p in cls.points.items()}
+    cls.fits = {k: params for k, (params, _) in cls.results.items()}
+
+  def test_infection_rate_on_bound_fails(self):
+    for k, p in self.points.items():
+      _, params = run_sir.fit_region((k, p['confirmed'], p['deaths'], p['recovered'], 1e9, 0))
+      on_bound = self.results[k][1].active_mask[1] != 0
+      self.assertEqual(params['status'] == 'ok', not on_bound, k)
+      self.assertGreater(params['iterations'], 0, k)
+
+  def test_not_worse_than_binary_start(self):
+    from scipy.optimize import least_squares
+    worse = []
+    for k, p in self.points.items():
+      A, b = sir.sir_system(*sir.trim_series(p['confirmed'], p['deaths'], p['recovered']))
+      local = least_squares(sir.sir_residuals, BINARY_START, jac=sir.sir_jacobian, args=(A, b),
+                            bounds=(0, np.inf), x_scale='jac', method='trf')
+      if self.results[k][1].cost > local.cost * (1 + 1e-6) + 1e-9:
+        worse.append(k)
+    self.assertEqual(worse, [])
+
+  @unittest.skipUnless(os.path.exists(REFERENCE), 'record it with ./run_sir.py --record-reference')
+  def test_matches_sir_model(self):
+    with open(REFERENCE, 'r') as f:
+      reference = json.load(f)
+    # Ceres may stop early on flat costs, a fit that differs has to be at least as good.
+    # Both report whole populations, so the cost of the fit is taken before rounding.
+    mismatched = []
+    for k, ref in reference.items():
+      fit, result = self.results[k]
+      diff = run_sir.compare_sir(fit, ref)
+      if diff and result.cost > cost(ref, self.points[k]) * (1 + 1e-6):
+        mismatched.append(k)
+      self.assertEqual((fit['i0'], fit['r0']), (ref['i0'], ref['r0']), k)
+    self.assertEqual(mismatched, [])
+
+if __name__ == '__main__':
+  unittest.main()
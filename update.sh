@@ -1,8 +1,8 @@
 #!/usr/bin/env bash
 
-./update_dataset.py
+./update_dataset.py --incremental --report reports/update.json
 
-./generate.py
+./generate.py --report reports/generate.json
 
 change=$(git diff | wc -l)
 
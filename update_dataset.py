@@ -1,22 +1,54 @@
 #!/usr/bin/env python3
 
 from datetime import datetime, timedelta
-from population import get_populations
+import population
+import fetch
+import instrument
+import manifest
+import store
+import argparse
+import sys
 import os
 import requests
 from urllib import request
-from io import BytesIO, StringIO
-import pandas as pd
-import matplotlib.pyplot as plt
 import json
 import numpy as np
 import re
+import hashlib
 
 TYPES = ['Confirmed','Recovered','Deaths']
-OUTPUT = '/home/max/covid-19/resources'
+OUTPUT = 'resources'
 BRANCH = 'master'
 DAILY="https://raw.githubusercontent.com/CSSEGISandData/COVID-19/{branch}/csse_covid_19_data/csse_covid_19_daily_reports/{date}.csv"
 SERIES = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/{branch}/csse_covid_19_data/csse_covid_19_time_series/time_series_19-covid-{type}.csv'
+COUNTRY_SERIES = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/{branch}/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_{type}_global.csv'
+CASES = ['confirmed','deaths','recovered']
+STATES_URL = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'
+COUNTIES_URL = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv'
+RAW = os.path.join('resources','raw')
+COUNTRIES = os.path.join(OUTPUT,'Countries.json')
+WORLD = os.path.join(OUTPUT,'World.json')
+STATES = os.path.join(OUTPUT,'States.json')
+POPULATIONS = os.path.join(OUTPUT,'populations.json')
+STATE_COORDS = os.path.join(OUTPUT,'state_coords.json')
+MANIFEST = os.path.join(OUTPUT,'build.json')
+GROUPS = os.path.join(OUTPUT,'groups.json')
+COUNTRIES_STORE = os.path.join(OUTPUT,'Countries' + store.SUFFIX)
+WORLD_STORE = os.path.join(OUTPUT,'World' + store.SUFFIX)
+STATES_STORE = os.path.join(OUTPUT,'States' + store.SUFFIX)
+COUNTIES_STORE = os.path.join(OUTPUT,'Counties' + store.SUFFIX)
+COUNTRY_COLUMNS = os.path.join(OUTPUT,'Countries.columns.json')
+STATE_COLUMNS = os.path.join(OUTPUT,'States.columns.json')
+SOURCES = [fetch.Source(c, COUNTRY_SERIES.format(branch = BRANCH, type = c), 'time_series_covid19_{}_global.csv'.format(c), 30) for c in CASES] + [
+  fetch.Source('world_population', population.WORLD_URL, 'world_population.html', 30),
+  fetch.Source('state_population', population.STATE_URL, 'state_population.csv', 30),
+  fetch.Source('states', STATES_URL, 'us-states.csv', 60),
+  fetch.Source('counties', COUNTIES_URL, 'us-counties.csv', 300),
+]
+COUNTY_COLUMNS = ['date','county','state','fips','cases','deaths']
+COUNTY_DTYPES = {'date': str, 'county': str, 'state': str, 'fips': np.float64, 'cases': np.int64, 'deaths': np.float64}
+COUNTY_CHUNK = 1 << 18
+DEFAULT_GROUPS = {'World': {'lat': -3.3, 'lon': -113.6, 'regions': '*'}}
 AGE_SHEET = '1jS24DjSPVWa4iuxuD4OAXrE3QeI8c9BC1hSlqr-NMiU'
 AGE_GID = 1187587451
 
@@ -58,140 +90,601 @@ def download_series_legacy(types = TYPES):
 def get_size(confirmed): 
   return int(np.log(confirmed[-1] + 1) * 5) 
 
-def download_countries():
-  print('Downloading world...')
-  URL_FMT = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/{}/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_{}_global.csv'
-  BRANCH = 'master'
-  cases = ['confirmed','deaths','recovered']
+def country_series(frames):
+  """
+  Sum the JHU global time series of every province into its country.
+
+  params:
+  frames(dict): JHU global time-series frames keyed by case type.
+
+  return(tuple): (country names, date labels, dict of country x date int64 matrices keyed by case type)
+  """
+  import pandas as pd
+  first = next(iter(frames.values()))
+  dates = [c for c in first.columns if c not in ignore]
+  names = pd.Index(pd.concat([df['Country/Region'] for df in frames.values()]).unique())
+  matrices = {}
+  for c, df in frames.items():
+    values = df.reindex(columns=dates).fillna(0).to_numpy(dtype=np.int64)
+    codes = names.get_indexer(df['Country/Region'])
+    summed = np.zeros((len(names), len(dates)), dtype=np.int64)
+    np.add.at(summed, codes, values)
+    matrices[c] = summed
+  return list(names), dates, matrices
+
+def country_coords(df):
+  """
+  Get a coordinate per country, preferring the row without a province.
+
+  params:
+  df(pd.DataFrame): JHU global time-series frame.
+
+  return(pd.DataFrame): Lat and Long indexed by country.
+  """
+  coords = df[['Country/Region','Lat','Long']].assign(main=df['Province/State'].isna())
+  coords = coords.sort_values('main', ascending=False, kind='stable')
+  return coords.drop_duplicates('Country/Region').set_index('Country/Region')
+
+def parse_countries(frames):
+  """
+  Convert the JHU global time-series frames to points keyed by country.
+
+  params:
+  frames(dict): JHU global time-series frames keyed by case type.
+
+  return(dict): points with summed series for every case type.
+  """
+  import pandas as pd
+  names, dates, matrices = country_series(frames)
+  coords = country_coords(pd.concat(frames.values())).reindex(names)
+  lat = coords['Lat'].fillna(0).tolist()
+  lon = coords['Long'].fillna(0).tolist()
+  series = {c: m.tolist() for c, m in matrices.items()}
   data = {}
-  for c in cases:
-    url = URL_FMT.format(BRANCH, c)
-    r = requests.get(url)
-    df = pd.read_csv(StringIO(r.text))
-    for idx, row in df.iterrows():
-      if row['Province/State'] != 'nan':
-        name = row['Country/Region']
-      else:
-        name = row['Province/State']
-      d = {}
-      d['name'] = name
-      d['lat'] = row['Lat']
-      d['lon'] = row['Long']
-      days = row.drop(['Province/State','Country/Region','Lat','Long'])
-      values = list(days.values)
-      d[c] = values
-      if c == 'confirmed':
-        d['size'] = get_size(values)
-      if name in data:
-        data[name][c] = values
-      else:
-        data[name] = d
-  fout = os.path.join('resources','Countries.json')
-  with open(fout,'w') as f:
+  for i, name in enumerate(names):
+    d = {'name': name, 'lat': lat[i], 'lon': lon[i]}
+    for c in CASES:
+      d[c] = series[c][i]
+    d['size'] = get_size(d['confirmed'])
+    data[name] = d
+  return data
+
+def load_json(path):
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def save_json(path, data):
+  with open(path, 'w') as f:
     json.dump(data, f)
-  print(fout)
+  print(path)
 
-def world_point():
-  fout = os.path.join('resources','Countries.json')
-  with open(fout,'r') as f:
-    data = json.load(f)
-  conf = None
-  rec = None
-  death = None
-  for k,v in data.items():
-    if conf is None:
-      conf = np.zeros(len(v['confirmed']))
-      rec = np.zeros(len(v['confirmed']))
-      death = np.zeros(len(v['confirmed']))
-    conf+=np.array(v['confirmed'])
-    rec+=np.array(v['recovered'])
-    death+=np.array(v['deaths'])
-  d = {
-    'World':{
-      'name': 'World',
-      'confirmed':conf.tolist(),
-      'deaths':death.tolist(),
-      'recovered':rec.tolist(),
-      'size':get_size(conf),
-      'lat': -3.3,
-      'lon': -113.6,
+def plan_update(stored, columns):
+  """
+  Compare upstream per-date digests with the ones recorded for an artifact.
+
+  params:
+  stored(dict): recorded columns, None if there are none.
+  columns(dict): dates, per-date digests and region key of the upstream data.
+
+  return(list): indices of new dates to append, None if a full rebuild is needed.
+  """
+  if stored is None or stored['key'] != columns['key']:
+    return None
+  n = len(stored['dates'])
+  if columns['dates'][:n] != stored['dates'] or columns['digests'][:n] != stored['digests']:
+    return None
+  return list(range(n, len(columns['dates'])))
+
+def append_series(data, cases, names, matrices):
+  """
+  Append new date columns to stored points in place.
+
+  params:
+  data(dict): stored points.
+  cases(list): case types to append.
+  names(list): point names in matrix row order.
+  matrices(dict): region x new date matrices keyed by case type.
+  """
+  series = {c: matrices[c].tolist() for c in cases}
+  for i, name in enumerate(names):
+    point = data[name]
+    for c in cases:
+      point[c].extend(series[c][i])
+    point['size'] = get_size(point['confirmed'])
+
+def country_columns(frames):
+  """
+  Digest every date column of the JHU global time-series frames.
+
+  params:
+  frames(dict): JHU global time-series frames keyed by case type.
+
+  return(dict): dates, per-date digests and a digest of the row keys.
+  """
+  first = next(iter(frames.values()))
+  dates = [c for c in first.columns if c not in ignore]
+  key = hashlib.sha1()
+  columns = []
+  for c in CASES:
+    df = frames[c]
+    key.update(df[['Province/State','Country/Region']].to_csv(index=False).encode())
+    values = df.reindex(columns=dates).fillna(0).to_numpy(dtype=np.int64)
+    columns.append(np.ascontiguousarray(values.T))
+  digests = [hashlib.sha1(b''.join(m[j].tobytes() for m in columns)).hexdigest() for j in range(len(dates))]
+  return {'dates': dates, 'digests': digests, 'key': key.hexdigest()}
+
+def patch_countries(frames, columns):
+  """
+  Append only the new dates to the stored countries.
+
+  return(dict): patched points, None if a full rebuild is needed.
+  """
+  new = plan_update(load_json(COUNTRY_COLUMNS), columns)
+  data = load_json(COUNTRIES)
+  if new is None or data is None:
+    return None
+  dates = [columns['dates'][j] for j in new]
+  print('Appending {} new dates'.format(len(dates)))
+  frames = {c: df.reindex(columns=ignore + dates) for c, df in frames.items()}
+  names, _, matrices = country_series(frames)
+  append_series(data, CASES, names, matrices)
+  return data
+
+def download_countries(raw, incremental = False):
+  import pandas as pd
+  print('Parsing world...')
+  frames = {c: pd.read_csv(raw[c]) for c in CASES}
+  instrument.count('rows', sum(len(df) for df in frames.values()))
+  columns = country_columns(frames)
+  data = patch_countries(frames, columns) if incremental else None
+  if data is None:
+    data = parse_countries(frames)
+  store.write_store(COUNTRIES_STORE, data, CASES, columns['dates'])
+  save_json(COUNTRIES, data)
+  save_json(COUNTRY_COLUMNS, columns)
+
+def load_groups(path = GROUPS):
+  """
+  Load the aggregate regions to roll countries up into.
+
+  params:
+  path(str): JSON config of groups keyed by name, each with lat, lon and a list of
+  member countries or "*" for every country. Defaults to World only if missing.
+
+  return(dict): groups.
+  """
+  if not os.path.exists(path):
+    return DEFAULT_GROUPS
+  return load_json(path)
+
+def group_index(regions, groups):
+  """
+  Build the membership matrix of every group.
+
+  params:
+  regions(list): region names in row order.
+  groups(dict): groups from load_groups.
+
+  return(np.ndarray): groups x regions int64 matrix of 0/1 membership.
+  """
+  rows = {name: i for i, name in enumerate(regions)}
+  index = np.zeros((len(groups), len(regions)), dtype=np.int64)
+  for g, (name, group) in enumerate(groups.items()):
+    members = group['regions']
+    if members == '*':
+      index[g] = 1
+      continue
+    missing = [m for m in members if m not in rows]
+    if missing:
+      print('{}: unknown regions {}'.format(name, ', '.join(missing)))
+    index[g, [rows[m] for m in members if m in rows]] = 1
+  return index
+
+def rollup(countries, groups):
+  """
+  Sum the country series into every group with one matrix product per metric.
+
+  params:
+  countries(store.Store): country store.
+  groups(dict): groups from load_groups.
+
+  return(dict): group points with integer series.
+  """
+  index = group_index(countries.regions, groups)
+  totals = {m: index.dot(countries.series[m].astype(np.int64)) for m in CASES}
+  points = {}
+  for g, (name, group) in enumerate(groups.items()):
+    points[name] = {
+      'name': name,
+      'confirmed': totals['confirmed'][g].tolist(),
+      'deaths': totals['deaths'][g].tolist(),
+      'recovered': totals['recovered'][g].tolist(),
+      'size': get_size(totals['confirmed'][g]) if totals['confirmed'].shape[1] else 0,
+      'lat': group['lat'],
+      'lon': group['lon'],
     }
+  return points
+
+def world_point():
+  countries = store.load_store(COUNTRIES_STORE)
+  d = rollup(countries, load_groups())
+  instrument.count('rows', len(countries.regions))
+  store.write_store(WORLD_STORE, d, CASES, countries.dates)
+  save_json(WORLD, d)
+
+def read_counties(path, window = 1, chunksize = COUNTY_CHUNK, series = None):
+  """
+  Stream the NYT us-counties CSV in chunks, keeping only the rows of the latest dates
+  so memory stays bounded by the window rather than the whole history.
+  Dates are compared as ISO strings, nothing is converted per row.
+
+  params:
+  path(str): us-counties.csv.
+  window(int): number of latest dates to keep, None keeps every date.
+  chunksize(int): rows per chunk.
+  series(dict): accumulator from county_accumulator to add every chunk to, None to skip.
+
+  return(pd.DataFrame): date, county, state, fips, cases and deaths of the kept rows.
+  """
+  import pandas as pd
+  dates = []
+  parts = []
+  for chunk in pd.read_csv(path, usecols=COUNTY_COLUMNS, dtype=COUNTY_DTYPES, chunksize=chunksize):
+    instrument.count('rows', len(chunk))
+    # Deaths are blank for some counties.
+    chunk = chunk.assign(deaths=chunk['deaths'].fillna(0).astype(np.int64))
+    if series is not None:
+      add_counties(series, chunk)
+    if window is None:
+      parts.append(chunk)
+      continue
+    latest = sorted(set(dates).union(chunk['date'].unique()))[-window:]
+    if latest != dates:
+      dates = latest
+      parts = [p[p['date'] >= dates[0]] for p in parts]
+    parts.append(chunk[chunk['date'] >= dates[0]])
+  if not parts:
+    return pd.DataFrame({k: pd.Series(dtype=v) for k, v in COUNTY_DTYPES.items()})
+  return pd.concat(parts, ignore_index=True)
+
+def county_keys(df):
+  """
+  Key counties by their 5 digit FIPS code. Areas without one, like New York City or
+  unknown counties, are keyed by state and county name.
+
+  params:
+  df(pd.DataFrame): NYT us-counties frame.
+
+  return(pd.Series): keys.
+  """
+  fips = df['fips'].fillna(0).astype(np.int64).map('{:05d}'.format)
+  names = df['state'] + '/' + df['county']
+  return fips.where(df['fips'].notna(), names)
+
+def county_accumulator():
+  """
+  Create the county x date accumulators that add_counties sums the chunks of the
+  us-counties CSV into.
+
+  return(dict): row and column indices, county info and int32 matrices.
+  """
+  empty = np.zeros((0, 0), dtype=store.DTYPE)
+  return {
+    'rows': {},
+    'dates': {},
+    'info': {},
+    'confirmed': empty,
+    'deaths': empty.copy(),
+    'reported': np.zeros((0, 0), dtype=bool),
   }
-  fout = os.path.join('resources','World.json')
-  with open(fout,'w') as f:
-    json.dump(d, f)
-  print(fout)
-
-def download_counties():
-  print('Downloading counties...')
-  URL = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv'
-  r = requests.get(URL)
-  df = pd.read_csv(StringIO(r.text))
-  # Get latest date.
-  df['date'] = pd.to_datetime(df['date'])
-  recent = df['date'].max()
-  latest = df.loc[df['date'] == recent]
+
+def grow(matrix, shape):
+  """
+  Get a matrix of at least shape holding the values of matrix. Matrices grow at most
+  once per chunk, so they are grown to the exact shape to keep the peak low.
+  """
+  if matrix.shape[0] >= shape[0] and matrix.shape[1] >= shape[1]:
+    return matrix
+  grown = np.zeros((max(shape[0], matrix.shape[0]), max(shape[1], matrix.shape[1])), dtype=matrix.dtype)
+  grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+  return grown
+
+def index_of(labels, index):
+  """
+  Get the positions of labels in an index, adding the ones not seen before.
+
+  params:
+  labels(pd.Index): labels to look up.
+  index(dict): position keyed by label, updated in place.
+
+  return(np.ndarray): position of every label.
+  """
+  import pandas as pd
+  codes, uniques = pd.factorize(labels)
+  lookup = np.array([index.setdefault(k, len(index)) for k in uniques], dtype=np.int64)
+  return lookup[codes]
+
+def add_counties(acc, chunk):
+  """
+  Sum a chunk of the NYT us-counties CSV into the accumulators, see county_accumulator.
+  Keys are built per county rather than per row.
+
+  params:
+  acc(dict): accumulators, updated in place.
+  chunk(pd.DataFrame): rows of the us-counties CSV with deaths filled in.
+  """
+  import pandas as pd
+  counties = chunk.groupby(['state','county','fips'], sort=False, dropna=False)
+  code = counties.ngroup().to_numpy()
+  info = counties.size().index.to_frame(index=False)
+  # Record counties in the order they were last reported, so later rows win.
+  last = np.zeros(len(info), dtype=np.int64)
+  np.maximum.at(last, code, np.arange(len(code)))
+  info = info.assign(key=county_keys(info)).iloc[np.argsort(last, kind='stable')]
+  for state, county, fips, key in info.itertuples(index=False):
+    acc['info'][key] = (state, county, fips)
+  county_rows = np.empty(len(info), dtype=np.int64)
+  county_rows[info.index.to_numpy()] = index_of(pd.Index(info['key']), acc['rows'])
+  rows = county_rows[code]
+  cols = index_of(chunk['date'], acc['dates'])
+  shape = (len(acc['rows']), len(acc['dates']))
+  for m, col in [('confirmed','cases'), ('deaths','deaths')]:
+    acc[m] = grow(acc[m], shape)
+    # Rows of the same county and date are summed.
+    np.add.at(acc[m], (rows, cols), chunk[col].to_numpy().astype(store.DTYPE))
+  acc['reported'] = grow(acc['reported'], shape)
+  acc['reported'][rows, cols] = True
+
+def county_series(acc):
+  """
+  Convert the accumulators to county points ordered by state, so the counties of each
+  state are a contiguous range of rows in the store.
+
+  params:
+  acc(dict): accumulators filled by add_counties.
+
+  return(tuple): (points keyed by county key, sorted dates, [start, stop) row ranges keyed by state)
+  """
+  keys = sorted(acc['rows'], key=lambda k: (acc['info'][k][0], acc['info'][k][1], k))
+  dates = sorted(acc['dates'])
+  rows = np.array([acc['rows'][k] for k in keys], dtype=np.int64)
+  cols = np.array([acc['dates'][d] for d in dates], dtype=np.int64)
+  reported = acc['reported'][np.ix_(rows, cols)]
+  # Series are cumulative, carry the last report over days a county is missing.
+  last = np.where(reported, np.arange(len(dates), dtype=np.int32), np.int32(0))
+  np.maximum.accumulate(last, axis=1, out=last)
+  matrices = {m: np.take_along_axis(acc[m][np.ix_(rows, cols)], last, axis=1) for m in ['confirmed','deaths']}
+  points = {}
+  for i, key in enumerate(keys):
+    state, county, fips = acc['info'][key]
+    points[key] = {
+      'state': state,
+      'county': county,
+      'fips': int(fips) if fips == fips and fips else None,
+      'confirmed': matrices['confirmed'][i],
+      'deaths': matrices['deaths'][i],
+    }
+  states = np.array([acc['info'][k][0] for k in keys], dtype=object)
+  starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]]) if len(states) else np.array([], dtype=int)
+  stops = np.r_[starts[1:], len(states)]
+  groups = {states[a]: [int(a), int(b)] for a, b in zip(starts, stops)}
+  return points, dates, groups
+
+def county_snapshot(df):
+  """
+  Get the cases and deaths of every county reported on the latest date.
+
+  return(dict): {state: {county: {'confirmed', 'deaths'}}}
+  """
+  latest = df[df['date'] == df['date'].max()]
   data = {}
-  for i, row in latest.iterrows():
-    name = row['state']
-    county = row['county']
-    if name not in data:
-      data[name] = {}
-    data[name][county] = {'confirmed':row['cases'],'deaths':row['deaths']}
+  for name, group in latest.groupby('state', sort=False):
+    values = zip(group['cases'].tolist(), group['deaths'].tolist())
+    data[name] = {county: {'confirmed':c,'deaths':d} for county, (c, d) in zip(group['county'].tolist(), values)}
   return data
 
-def download_states():
-  print('Downloading states...')
-  URL = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'
-  r = requests.get(URL)
-  df = pd.read_csv(StringIO(r.text))
-  with open('resources/state_coords.json', 'r') as f:
-    states = json.load(f)
+def download_counties(raw, series = True):
+  """
+  Parse the counties, writing their full time series to the counties store. The CSV is
+  streamed once, summing every chunk into county x date matrices while keeping only the
+  rows of the latest date.
+
+  params:
+  raw(dict): raw file paths keyed by source name.
+  series(bool): write the store, otherwise only stream the latest date.
+
+  return(dict): latest cases and deaths by state and county, see county_snapshot.
+  """
+  print('Parsing counties...')
+  acc = county_accumulator() if series else None
+  df = read_counties(raw['counties'], series=acc)
+  if series:
+    points, dates, groups = county_series(acc)
+    store.write_store(COUNTIES_STORE, points, ['confirmed','deaths'], dates, groups)
+  return county_snapshot(df)
+
+def state_series(df, names):
+  """
+  Build the date x state matrices for confirmed and deaths in one pass.
+
+  params:
+  df(pd.DataFrame): NYT us-states frame with date, state, cases and deaths columns.
+  names(list): state names to emit, in output order.
+
+  return(tuple): (confirmed, deaths) DataFrames indexed by date with one column per state.
+  """
+  import pandas as pd
+  df = df[df['state'].isin(names)]
+  dates = pd.Index(df['date'].unique()).sort_values()
+  table = df.groupby(['date','state'])[['cases','deaths']].sum().unstack('state')
+  matrices = []
+  for col in ['cases','deaths']:
+    m = table[col].reindex(index=dates, columns=names).fillna(0).astype(np.int64)
+    matrices.append(m)
+  return tuple(matrices)
+
+def parse_states(df, states):
+  """
+  Convert the NYT us-states frame to points keyed by state name.
+
+  params:
+  df(pd.DataFrame): NYT us-states frame.
+  states(dict): state coordinates keyed by name.
+
+  return(dict): points with zero-padded confirmed and deaths series.
+  """
+  names = list(states.keys())
+  confirmed, deaths = state_series(df, names)
   points = {}
-  max_len = 0;
-  for k, v in states.items():
-    data = {'name': k, 'lat': v['lat'], 'lon': v['lon'], 'confirmed':[],'deaths':[],'recovered':[]}
-    for i, row in df.iterrows():
-      if row['state'] == k:
-        data['confirmed'].append(row['cases'])
-        data['deaths'].append(row['deaths'])
+  for k in names:
+    v = states[k]
+    data = {'name': k, 'lat': v['lat'], 'lon': v['lon'], 'confirmed':confirmed[k].tolist(),'deaths':deaths[k].tolist(),'recovered':[]}
     data['size'] = get_size(data['confirmed'])
     points[k] = data
-    max_len = max(max_len, len(data['confirmed']))
+  return points
+
+def state_columns(df, names):
+  """
+  Digest every date of the NYT us-states frame.
+
+  params:
+  df(pd.DataFrame): NYT us-states frame.
+  names(list): state names to emit.
+
+  return(dict): dates, per-date digests and a digest of the state names.
+  """
+  import pandas as pd
+  df = df[df['state'].isin(names)]
+  rows = pd.util.hash_pandas_object(df[['state','cases','deaths']], index=False).to_numpy()
+  codes, dates = pd.factorize(df['date'], sort=True)
+  summed = np.zeros(len(dates), dtype=np.uint64)
+  np.add.at(summed, codes, rows)
+  key = hashlib.sha1('\n'.join(names).encode()).hexdigest()
+  return {'dates': list(dates), 'digests': ['{:016x}'.format(h) for h in summed], 'key': key}
 
-  # Backfill data
-  for k, v in points.items():
-    while len(v['confirmed']) < max_len:
-      v['confirmed'].insert(0,0)
-      v['deaths'].insert(0,0)
+def patch_states(df, names, columns):
+  """
+  Append only the new dates to the stored states.
+
+  return(dict): patched points, None if a full rebuild is needed.
+  """
+  new = plan_update(load_json(STATE_COLUMNS), columns)
+  points = load_json(STATES)
+  if new is None or points is None:
+    return None
+  dates = [columns['dates'][j] for j in new]
+  print('Appending {} new dates'.format(len(dates)))
+  confirmed, deaths = state_series(df[df['date'].isin(dates)], names)
+  matrices = {
+    'confirmed': confirmed.reindex(dates).fillna(0).to_numpy(dtype=np.int64).T,
+    'deaths': deaths.reindex(dates).fillna(0).to_numpy(dtype=np.int64).T,
+  }
+  append_series(points, ['confirmed','deaths'], names, matrices)
+  return points
+
+def download_states(raw, incremental = False):
+  import pandas as pd
+  print('Parsing states...')
+  df = pd.read_csv(raw['states'])
+  instrument.count('rows', len(df))
+  with open(STATE_COORDS, 'r') as f:
+    states = json.load(f)
+  names = list(states.keys())
+  columns = state_columns(df, names)
+  points = patch_states(df, names, columns) if incremental else None
+  if points is None:
+    points = parse_states(df, states)
 
   # Fill counties.
-  counties = download_counties()
+  with instrument.stage('counties'):
+    counties = download_counties(raw)
   for k, v in counties.items():
     try:
       points[k]['counties'] = v
     except:
       pass
-  outfile = 'resources/States.json'
-  with open(outfile, 'w') as f:
-    json.dump(points,f)
-  print(outfile)
+  store.write_store(STATES_STORE, points, ['confirmed','deaths'], columns['dates'])
+  save_json(STATES, points)
+  save_json(STATE_COLUMNS, columns)
 
-def download_populations():
-  print('Downloading populations...')
-  outfile = os.path.join(OUTPUT,'populations.json')
-  d = get_populations()
+def read_raw(path, encoding = 'utf-8'):
+  with open(path, 'r', encoding=encoding) as f:
+    return f.read()
+
+def download_populations(raw):
+  print('Parsing populations...')
+  outfile = POPULATIONS
+  world = population.parse_world_population(read_raw(raw['world_population']))
+  states = population.parse_state_population(read_raw(raw['state_population'], 'latin-1'))
+  d = population.merge_populations(world, states)
+  instrument.count('rows', len(d))
   with open(outfile, 'w') as f:
     json.dump(d,f)
   print(outfile)
 
-def main():
+def run_stage(built, name, inputs, outputs, fn, *args, force = False):
+  """
+  Run a build stage unless its inputs match the last build.
+
+  params:
+  built(dict): loaded build manifest.
+  name(str): stage name.
+  inputs(dict): input content hashes keyed by input name.
+  outputs(list): files written by the stage.
+  fn(function): stage function.
+  force(bool): run the stage even if its inputs are unchanged.
+
+  return(bool): True if the stage ran.
+  """
+  if not force and manifest.is_current(built, name, inputs, outputs):
+    print('{} unchanged, skipping'.format(name))
+    instrument.skip(name)
+    return False
+  with instrument.stage(name):
+    fn(*args)
+  manifest.record(built, name, inputs)
+  return True
+
+def main(argv = sys.argv[1:]):
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--cache',type=str,default=RAW,help="directory to store raw upstream files in")
+  parser.add_argument('--jobs',type=int,default=len(SOURCES),help="number of concurrent downloads")
+  parser.add_argument('--retries',type=int,default=3,help="retries per download")
+  parser.add_argument('--mirror',type=str,default=None,help="base URL of a stand-in server serving the raw cache files")
+  parser.add_argument('--fetch-only',dest='fetch_only',action='store_true',help="only fill the raw cache directory")
+  parser.add_argument('--incremental',action='store_true',help="only append new dates to the stored series unless upstream revised history")
+  parser.add_argument('--force',action='store_true',help="rebuild every stage even if its inputs are unchanged")
+  parser.add_argument('--report',type=str,default=None,help="write stage timings, memory and counters to this JSON file")
+  parser.add_argument('--profile',type=str,default=None,help="directory to write a cProfile dump per stage to")
+  args = parser.parse_args(argv)
+  instrument.configure(args.profile)
+  try:
+    build(args)
+  finally:
+    if args.report:
+      instrument.save_report(args.report)
+
+def build(args):
+  with instrument.stage('fetch'):
+    raw = fetch.fetch_all(SOURCES, args.cache, args.jobs, args.retries, args.mirror)
+  if args.fetch_only:
+    return
   os.makedirs(OUTPUT, exist_ok=True)
-  download_countries()
-  world_point()
-  download_populations()
-  download_states()
+  # The manifest is shared with generate.py, so it is loaded even when forced.
+  built = manifest.load_manifest(MANIFEST)
+  digests = {name: fetch.digest(path) for name, path in raw.items()}
+  def inputs(*names):
+    return {name: digests[name] for name in names}
+  run_stage(built, 'countries', inputs(*CASES), [COUNTRIES, COUNTRIES_STORE], download_countries, raw, args.incremental, force=args.force)
+  world_inputs = {'countries': manifest.hash_file(COUNTRIES), 'groups': manifest.hash_file(GROUPS) if os.path.exists(GROUPS) else None}
+  run_stage(built, 'world', world_inputs, [WORLD, WORLD_STORE], world_point, force=args.force)
+  run_stage(built, 'populations', inputs('world_population', 'state_population'), [POPULATIONS], download_populations, raw, force=args.force)
+  state_inputs = {**inputs('states', 'counties'), 'state_coords': manifest.hash_file(STATE_COORDS)}
+  run_stage(built, 'states', state_inputs, [STATES, STATES_STORE, COUNTIES_STORE], download_states, raw, args.incremental, force=args.force)
+  manifest.save_manifest(MANIFEST, built)
 
 if __name__ == '__main__':
   main()
-